@@ -0,0 +1,87 @@
+# Пропускная способность handle_datagram при нескольких кормушках сразу:
+# каждый поток шлёт пакеты от своего клиента прямо в обработчик (без сети),
+# параллельно "веб" непрерывно читает список клиентов и ищет клиента по id.
+# Запуск: python bench/client_registry.py [--feeders 1,4,16] [--seconds 3] [--readers 2]
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server", "src"))
+
+import udp_server  # noqa: E402
+import web_server  # noqa: E402
+
+PACKET_SIZE = 1400
+PACKETS_PER_FRAME = 10
+
+
+def frame_packets(seq):
+    payload = bytes(PACKET_SIZE)
+    return [struct.pack('!IHH', seq, i, PACKETS_PER_FRAME) + payload for i in range(PACKETS_PER_FRAME)]
+
+
+def run(feeders, seconds, readers):
+    server = udp_server.BatchUDPServer(("127.0.0.1", 0))
+    web_server.app.state.server = server
+    stop = threading.Event()
+    counts = [0] * feeders
+    lookups = [0] * readers
+
+    def feed(index):
+        addr = ("10.0.0.%d" % (index + 1), 40000 + index)
+        handle = server.handle_datagram
+        seq = 0
+        while not stop.is_set():
+            for packet in frame_packets(seq):
+                handle(packet, addr)
+            counts[index] += PACKETS_PER_FRAME
+            seq += 1
+
+    def read(index):
+        while not stop.is_set():
+            for i in range(feeders):
+                try:
+                    web_server.find_client("10.0.0.%d:%d" % (i + 1, 40000 + i))
+                except Exception:
+                    pass
+            lookups[index] += feeders
+
+    threads = [threading.Thread(target=feed, args=(i,)) for i in range(feeders)]
+    threads += [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    server.server_close()
+    packets = sum(counts)
+    return {
+        "feeders": feeders,
+        "packets_per_sec": round(packets / elapsed),
+        "us_per_packet": round(cpu / packets * 1e6, 2),
+        "min_feeder_share": round(min(counts) / (packets / feeders), 2),
+        "lookups_per_sec": round(sum(lookups) / elapsed),
+    }
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--feeders", default="1,4,16")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--readers", type=int, default=2)
+    args = parser.parse_args()
+    results = [run(int(n), args.seconds, args.readers) for n in args.feeders.split(",")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    cli()
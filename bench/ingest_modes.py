@@ -0,0 +1,100 @@
+# Сравнение режимов приёма UDP: пакетов в секунду и CPU на сервере.
+# Запуск: python bench/ingest_modes.py [--seconds 5] [--rate 0] [--modes threaded,batch,asyncio]
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server", "src"))
+
+PACKET_SIZE = 1400
+PACKETS_PER_FRAME = 20
+
+
+def run_server(mode, port, seconds, result_queue):
+    import udp_server
+
+    server = udp_server.make_server(("127.0.0.1", port), mode)
+    handled = [0]
+    handle = server.handle_datagram
+
+    def counting_handle(data, addr):
+        handled[0] += 1
+        handle(data, addr)
+
+    server.handle_datagram = counting_handle
+    cpu_start = time.process_time()
+
+    if mode == "asyncio":
+        class _Idle:
+            async def serve(self):
+                await asyncio.sleep(seconds + 1)
+        asyncio.run(server.serve(_Idle()))
+    else:
+        threading.Timer(seconds + 1, server.shutdown).start()
+        server.serve_forever()
+    server.server_close()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    result_queue.put({
+        "handled": handled[0],
+        "cpu_seconds": time.process_time() - cpu_start,
+        "threads_max_rss_kb": usage.ru_maxrss,
+    })
+
+
+def blast(port, seconds, rate):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = bytes(PACKET_SIZE)
+    sent = 0
+    seq = 0
+    interval = 1 / rate if rate else 0
+    deadline = time.time() + seconds
+    next_send = time.time()
+    while time.time() < deadline:
+        for num in range(PACKETS_PER_FRAME):
+            header = seq.to_bytes(4, 'big') + num.to_bytes(2, 'big') + PACKETS_PER_FRAME.to_bytes(2, 'big')
+            sock.sendto(header + payload, ("127.0.0.1", port))
+            sent += 1
+            if interval:
+                next_send += interval
+                time.sleep(max(0, next_send - time.time()))
+        seq = (seq + 1) % 2**32
+    sock.close()
+    return sent
+
+
+def bench(mode, seconds, rate, port):
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=run_server, args=(mode, port, seconds, queue))
+    proc.start()
+    time.sleep(0.5)  # Даём серверу привязать сокет
+    sent = blast(port, seconds, rate)
+    result = queue.get()
+    proc.join()
+    result.update({
+        "mode": mode,
+        "sent": sent,
+        "packets_per_sec": result["handled"] / seconds,
+        "loss": 1 - result["handled"] / sent if sent else 0,
+        "cpu_us_per_packet": result["cpu_seconds"] / result["handled"] * 1e6 if result["handled"] else None,
+    })
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--rate", type=float, default=0, help="пакетов/с, 0 - без ограничения")
+    parser.add_argument("--modes", default="threaded,batch,asyncio")
+    parser.add_argument("--port", type=int, default=50105)
+    args = parser.parse_args()
+
+    for i, mode in enumerate(args.modes.split(",")):
+        print(json.dumps(bench(mode, args.seconds, args.rate, args.port + i)))
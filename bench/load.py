@@ -0,0 +1,522 @@
+# Нагрузочный прогон сервера без камер: N синтетических кормушек шлют
+# готовые JPEG по настоящему протоколу (8-байтовый заголовок seq/num/total)
+# с настраиваемыми потерями, перестановками, дублями и джиттером, а M зрителей
+# одновременно смотрят /video, /screenshot и /stream. Сервер запускается
+# отдельным процессом (server/src/main.py, порты 50005 и 5000), его CPU и
+# RSS берутся из /proc. Всё на одной машине через loopback, результат - json.
+#
+# Время отправки кадра кормушка кладёт в COM-сегмент JPEG, поэтому зритель
+# считает задержку от отправки до получения без изменений в сервере.
+#
+# Запуск: python bench/load.py [--feeders 8] [--fps 15] [--seconds 10]
+#   [--viewers 4] [--viewer-kinds video,screenshot,stream] [--loss 0.01]
+#   [--reorder 0.01] [--duplicate 0.01] [--jitter-ms 5] [--seed 0]
+#   [--set INGEST_MODE=batch] [--no-spawn] [--out result.json]
+import argparse
+import ast
+import asyncio
+import glob
+import heapq
+import json
+import multiprocessing
+import os
+import random
+import re
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVER_DIR = os.path.join(ROOT, "server", "src")
+
+UDP_PORT = 50005
+WEB_PORT = 5000
+PACKET_HEADER = struct.Struct('!IHH')  # Как client/src/packetizer.LEGACY_HEADER
+STAMP = struct.Struct('!4sdH')  # Метка в COM-сегменте: b"FFLB", время отправки, номер кормушки
+STAMP_TAG = b"FFLB"
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+# Настройки сервера по умолчанию для прогона: запись на диск мерила бы диск
+DEFAULT_OVERRIDES = {"RECORDING_ENABLED": False}
+
+
+# --- Кадры ---
+
+def synthetic_fixtures(count, width, height, quality, seed):
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 6)
+    background = cv2.normalize(background, None, 0, 255, cv2.NORM_MINMAX)
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    result = []
+    for i in range(count):
+        image = cv2.add(background, rng.integers(0, 4, background.shape, dtype=np.uint8))
+        x = width // 3 + int(width / 8 * np.sin(i / 5))
+        cv2.circle(image, (x, height // 2), height // 8, (40, 90, 160), -1)
+        result.append(cv2.imencode('.jpg', image, params)[1].tobytes())
+    return result
+
+
+def load_fixtures(args):
+    if args.fixtures:
+        paths = sorted(glob.glob(os.path.join(args.fixtures, "*.jpg")))
+        if not paths:
+            sys.exit(f"В {args.fixtures} нет *.jpg")
+        fixtures = []
+        for path in paths:
+            with open(path, "rb") as f:
+                fixtures.append(f.read())
+        return fixtures
+    return synthetic_fixtures(args.fixture_frames, args.width, args.height, args.quality, args.seed)
+
+
+# JPEG с меткой сразу после SOI - декодеры COM-сегмент пропускают
+def stamp(jpeg, feeder):
+    payload = STAMP.pack(STAMP_TAG, time.time(), feeder)
+    return jpeg[:2] + b'\xff\xfe' + struct.pack('!H', len(payload) + 2) + payload + jpeg[2:]
+
+
+def read_stamp(data):
+    if len(data) >= 6 + STAMP.size and data[2:4] == b'\xff\xfe':
+        tag, sent, feeder = STAMP.unpack_from(data, 6)
+        if tag == STAMP_TAG:
+            return sent
+    return None
+
+
+# --- Кормушки (отдельный процесс, чтобы не делить GIL со зрителями) ---
+
+def feeder_ports(args):
+    return [args.feeder_port + i for i in range(args.feeders)]
+
+
+def run_feeders(args, fixtures, start_at, results):
+    rng = random.Random(args.seed)
+    target = (args.host, UDP_PORT)
+    sockets = []
+    for port in feeder_ports(args):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+        sock.bind(("127.0.0.1", port))
+        sockets.append(sock)
+
+    interval = 1 / args.fps
+    jitter = args.jitter_ms / 1000
+    # Кормушки стартуют вразнобой в пределах одного интервала
+    schedule = [(start_at + interval * i / args.feeders, i) for i in range(args.feeders)]
+    heapq.heapify(schedule)
+    end_at = start_at + args.seconds
+    seqs = [0] * args.feeders
+    stats = {"frames_sent": 0, "packets_sent": 0, "packets_lost": 0,
+             "packets_duplicated": 0, "packets_reordered": 0, "late_sends": 0}
+
+    while schedule:
+        due, i = heapq.heappop(schedule)
+        if due >= end_at:
+            continue
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -interval:
+            stats["late_sends"] += 1  # Генератор не успевает - результат под вопросом
+
+        seq = seqs[i]
+        data = stamp(fixtures[(seq + i) % len(fixtures)], i)
+        total = -(-len(data) // args.mtu)
+        packets = [PACKET_HEADER.pack(seq % 2**32, n, total) + data[n * args.mtu:(n + 1) * args.mtu]
+                   for n in range(total)]
+        n = 0
+        while n < len(packets) - 1:
+            if rng.random() < args.reorder:
+                packets[n], packets[n + 1] = packets[n + 1], packets[n]
+                stats["packets_reordered"] += 1
+                n += 1
+            n += 1
+        sock = sockets[i]
+        for packet in packets:
+            if rng.random() < args.loss:
+                stats["packets_lost"] += 1
+                continue
+            sock.sendto(packet, target)
+            stats["packets_sent"] += 1
+            if rng.random() < args.duplicate:
+                sock.sendto(packet, target)
+                stats["packets_sent"] += 1
+                stats["packets_duplicated"] += 1
+        stats["frames_sent"] += 1
+        seqs[i] += 1
+        heapq.heappush(schedule, (due + interval + rng.uniform(-jitter, jitter), i))
+
+    for sock in sockets:
+        sock.close()
+    results.put(stats)
+
+
+# --- Зрители ---
+
+async def http_get(host, path):
+    reader, writer = await asyncio.open_connection(host, WEB_PORT)
+    # HTTP/1.0 - тело без chunked, multipart и SSE читаются как есть
+    writer.write(f"GET {path} HTTP/1.0\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return reader, writer, int(status_line.split()[1]), headers
+
+
+class ViewerResult:
+    def __init__(self, kind, client_id):
+        self.kind = kind
+        self.client_id = client_id
+        self.frames = 0
+        self.events = 0
+        self.errors = 0
+        self.latencies = []
+        self.started = None
+        self.stopped = None
+
+    def frame(self, data):
+        self.frames += 1
+        sent = read_stamp(data)
+        if sent is not None:
+            self.latencies.append(time.time() - sent)
+
+
+async def view_video(host, result, stop):
+    reader, writer, status, _ = await http_get(host, f"/video/{result.client_id}")
+    if status != 200:
+        result.errors += 1
+        writer.close()
+        return
+    try:
+        while not stop.is_set():
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if line == b'\r\n':
+                    if headers:
+                        break
+                    continue
+                name, _, value = line.decode(errors="replace").partition(':')
+                headers[name.strip().lower()] = value.strip()
+            data = await reader.readexactly(int(headers["content-length"]))
+            result.frame(data)
+    finally:
+        writer.close()
+
+
+async def view_screenshot(host, result, stop):
+    after = None
+    while not stop.is_set():
+        path = f"/screenshot/{result.client_id}" + (f"?after={after}" if after is not None else "")
+        reader, writer, status, headers = await http_get(host, path)
+        try:
+            if status == 200:
+                result.frame(await reader.readexactly(int(headers["content-length"])))
+                after = int(headers["x-frame-id"])
+            elif status != 304:
+                result.errors += 1
+                await asyncio.sleep(0.1)
+        finally:
+            writer.close()
+
+
+async def view_stream(host, result, stop):
+    reader, writer, status, _ = await http_get(host, "/stream")
+    if status != 200:
+        result.errors += 1
+        writer.close()
+        return
+    try:
+        while not stop.is_set():
+            line = await reader.readline()
+            if not line:
+                return
+            if line == b'\n' or line == b'\r\n':
+                result.events += 1
+    finally:
+        writer.close()
+
+
+VIEWERS = {"video": view_video, "screenshot": view_screenshot, "stream": view_stream}
+
+
+async def run_viewer(host, result, stop):
+    result.started = time.monotonic()
+    try:
+        await VIEWERS[result.kind](host, result, stop)
+    except (OSError, asyncio.IncompleteReadError, ValueError, KeyError):
+        result.errors += 1
+    finally:
+        result.stopped = time.monotonic()
+
+
+# --- Сервер ---
+
+def start_server(overrides, log_path):
+    settings = "; ".join(f"config.{name} = {value!r}" for name, value in overrides.items())
+    code = f"import config; {settings}; import runpy; runpy.run_path('main.py', run_name='__main__')"
+    log = open(log_path, "w")
+    return subprocess.Popen([sys.executable, "-c", code], cwd=SERVER_DIR, stdout=log, stderr=subprocess.STDOUT,
+                            env={**os.environ, "TERM": "dumb"})
+
+
+# Ждём и процессы приёма (multiprocess), чтобы следующий прогон получил порт
+def stop_server(server, timeout=5):
+    pids = process_tree(server.pid)
+    server.terminate()
+    try:
+        server.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        server.kill()
+    deadline = time.time() + timeout
+    for pid in pids[1:]:
+        while os.path.exists(f"/proc/{pid}") and time.time() < deadline:
+            time.sleep(0.1)
+
+
+def wait_ready(host, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://{host}:{WEB_PORT}/number_clients", timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def process_tree(pid):
+    pids = [pid]
+    for p in pids:
+        try:
+            for task in os.listdir(f"/proc/{p}/task"):
+                with open(f"/proc/{p}/task/{task}/children") as f:
+                    pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+# (CPU в секундах, RSS в байтах) сервера вместе с процессами приёма
+def process_usage(pid):
+    cpu = rss = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLK_TCK
+            rss += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            pass
+    return cpu, rss
+
+
+async def sample_usage(pid, samples, stop):
+    while not stop.is_set():
+        samples.append(process_usage(pid)[1])
+        await asyncio.sleep(0.5)
+
+
+_SAMPLE = re.compile(r'^(\w+)(?:\{[^}]*\})? (\S+)$')
+
+
+# Сумма каждой метрики /metrics по всем меткам
+def scrape(host):
+    totals = {}
+    try:
+        with urllib.request.urlopen(f"http://{host}:{WEB_PORT}/metrics", timeout=5) as response:
+            text = response.read().decode()
+    except OSError:
+        return totals
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match:
+            totals[match.group(1)] = totals.get(match.group(1), 0) + float(match.group(2))
+    return totals
+
+
+# --- Прогон ---
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize_viewers(viewers):
+    result = {}
+    for kind in VIEWERS:
+        group = [v for v in viewers if v.kind == kind]
+        if not group:
+            continue
+        durations = [max(v.stopped - v.started, 1e-3) for v in group]
+        entry = {"count": len(group), "errors": sum(v.errors for v in group)}
+        if kind == "stream":
+            entry["events"] = sum(v.events for v in group)
+        else:
+            fps = [v.frames / d for v, d in zip(group, durations)]
+            entry["fps_mean"] = round(sum(fps) / len(fps), 2)
+            entry["fps_min"] = round(min(fps), 2)
+        result[kind] = entry
+    return result
+
+
+async def observe(args, server_pid, feeders_done):
+    stop = asyncio.Event()
+    rss_samples = []
+    ids = [f"127.0.0.1:{port}" for port in feeder_ports(args)]
+    kinds = args.viewer_kinds.split(",")
+    viewers = [ViewerResult(kinds[i % len(kinds)], ids[i % len(ids)]) for i in range(args.viewers)]
+
+    tasks = []
+    if server_pid is not None:
+        tasks.append(asyncio.create_task(sample_usage(server_pid, rss_samples, stop)))
+    await asyncio.sleep(args.warmup)  # Клиенты должны успеть появиться на сервере
+    tasks += [asyncio.create_task(run_viewer(args.host, v, stop)) for v in viewers]
+    await asyncio.get_running_loop().run_in_executor(None, feeders_done.wait)
+    stop.set()
+    await asyncio.sleep(0.5)  # Дать последним кадрам дойти
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return viewers, rss_samples
+
+
+def run(args):
+    fixtures = load_fixtures(args)
+    overrides = {**DEFAULT_OVERRIDES}
+    for item in args.set:
+        name, _, value = item.partition("=")
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value  # Строка без кавычек: --set INGEST_MODE=batch
+
+    server = None
+    if not args.no_spawn:
+        server = start_server(overrides, args.server_log)
+        if not wait_ready(args.host):
+            server.kill()
+            sys.exit(f"Сервер не запустился, см. {args.server_log}")
+    before = scrape(args.host)
+    cpu_before = process_usage(server.pid)[0] if server else None
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    start_at = time.time() + 0.2
+    feeder = context.Process(target=run_feeders, args=(args, fixtures, start_at, results))
+    feeder.start()
+    done = context.Event()
+
+    def wait_feeder():
+        feeder.join()
+        done.set()
+
+    threading.Thread(target=wait_feeder, daemon=True).start()
+    started = time.time()
+    viewers, rss_samples = asyncio.run(observe(args, server.pid if server else None, done))
+    sent = results.get(timeout=5)
+    elapsed = time.time() - started
+    after = scrape(args.host)
+    cpu_after = process_usage(server.pid)[0] if server else None
+
+    if server is not None:
+        stop_server(server)
+
+    def delta(name):
+        if name not in after:
+            return None  # В режиме multiprocess веб не видит счётчиков сборки
+        return round(after[name] - before.get(name, 0))
+
+    received = delta("ff_packets_received_total")
+    completed = delta("ff_frames_completed_total")
+    latencies = [l for v in viewers for l in v.latencies]
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("server_log", "out")},
+        "server_overrides": overrides,
+        "fixture_bytes_mean": round(sum(map(len, fixtures)) / len(fixtures)),
+        "ingest": {
+            **sent,
+            "packets_per_sec_sent": round(sent["packets_sent"] / args.seconds),
+            "packets_received": received,
+            "packets_per_sec": round(received / args.seconds) if received is not None else None,
+            "frames_completed": completed,
+            "completed_ratio": round(completed / sent["frames_sent"], 4)
+            if completed is not None and sent["frames_sent"] else None,
+            "frames_evicted": delta("ff_frames_evicted_total"),
+            "udp_drops": delta("ff_udp_drops_total"),
+        },
+        "latency_ms": {
+            "samples": len(latencies),
+            "p50": _ms(percentile(latencies, 0.5)),
+            "p95": _ms(percentile(latencies, 0.95)),
+            "p99": _ms(percentile(latencies, 0.99)),
+        },
+        "viewers": summarize_viewers(viewers),
+        "server": {
+            "cpu_seconds": round(cpu_after - cpu_before, 2) if server else None,
+            "cpu_percent": round((cpu_after - cpu_before) / elapsed * 100, 1) if server else None,
+            "rss_mb_max": round(max(rss_samples) / 2**20, 1) if rss_samples else None,
+        },
+    }
+    return result
+
+
+def _ms(value):
+    return round(value * 1000, 2) if value is not None else None
+
+
+def cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--feeders", type=int, default=8)
+    parser.add_argument("--feeder-port", type=int, default=42000, help="порт первой кормушки")
+    parser.add_argument("--fps", type=float, default=15)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=1, help="через сколько секунд подключать зрителей")
+    parser.add_argument("--mtu", type=int, default=1400)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--reorder", type=float, default=0.0)
+    parser.add_argument("--duplicate", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--viewers", type=int, default=4)
+    parser.add_argument("--viewer-kinds", default="video,screenshot,stream")
+    parser.add_argument("--fixtures", help="папка с *.jpg вместо синтетических кадров")
+    parser.add_argument("--fixture-frames", type=int, default=30)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="переопределить настройку server/src/config.py (значение - литерал Python)")
+    parser.add_argument("--no-spawn", action="store_true", help="не запускать сервер, нагружать уже работающий")
+    parser.add_argument("--server-log", default=os.path.join(ROOT, "bench_server.log"))
+    parser.add_argument("--out", help="куда сохранить json (по умолчанию только stdout)")
+    args = parser.parse_args()
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,109 @@
+# Нарезка и отправка кадра: старый способ (срез + склейка + sendto на пакет)
+# против Packetizer (переиспользуемые буферы, пачки через UDP GSO).
+# Пакеты уходят на локальный сокет, который их не читает.
+# Запуск: python bench/packetizer.py [--frames 300] [--size 60000] [--fec 0]
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client", "src"))
+
+from packetizer import Packetizer  # noqa: E402
+
+MTU_SIZE = 1400
+
+
+class LegacySender:
+    def __init__(self, sock, address, mtu):
+        self.sock = sock
+        self.address = address
+        self.mtu = mtu
+        self.syscalls = 0
+
+    def send_frame(self, seq, data):
+        data = data.tobytes()
+        total = (len(data) + self.mtu - 1) // self.mtu
+        for i in range(total):
+            chunk = data[i * self.mtu:(i + 1) * self.mtu]
+            self.sock.sendto(struct.pack('!IHH', seq, i, total) + chunk, self.address)
+            self.syscalls += 1
+        return total
+
+
+def run(name, make_sender, frame, frames):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 16)  # Очередь быстро заполнится, ядро просто отбросит лишнее
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = make_sender(sock, sink.getsockname())
+
+    sender.send_frame(0, frame)  # Прогрев
+    sender.syscalls = 0
+    packets = 0
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for seq in range(frames):
+        packets += sender.send_frame(seq, frame)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    syscalls = sender.syscalls
+
+    # Выделения памяти считаем отдельным проходом: tracemalloc сильно замедляет
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    for seq in range(20):
+        sender.send_frame(seq, frame)
+    stats = tracemalloc.take_snapshot().compare_to(snapshot_before, "filename")
+    allocated = sum(s.size_diff for s in stats if s.size_diff > 0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sock.close()
+    sink.close()
+    return {
+        "sender": name,
+        "packets_per_sec": round(packets / elapsed),
+        "frames_per_sec": round(frames / elapsed),
+        "us_per_packet": round(cpu / packets * 1e6, 2),
+        "syscalls_per_frame": round(syscalls / frames, 1),
+        "peak_alloc_bytes_per_frame": round(peak / 20),
+        "retained_bytes": allocated,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--size", type=int, default=60000, help="размер кадра JPEG, байт")
+    parser.add_argument("--fec", type=int, default=0, help="размер группы FEC, 0 - без FEC")
+    parser.add_argument("--batch", type=int, default=32)
+    args = parser.parse_args()
+
+    frame = np.random.default_rng(0).integers(0, 256, args.size, dtype=np.uint8)
+    senders = [
+        ("packetizer_nogso", lambda s, a: Packetizer(s, a, MTU_SIZE, args.fec, args.batch, use_gso=False)),
+        ("packetizer_gso", lambda s, a: Packetizer(s, a, MTU_SIZE, args.fec, args.batch, use_gso=True)),
+    ]
+    if not args.fec:
+        senders.insert(0, ("legacy", lambda s, a: LegacySender(s, a, MTU_SIZE)))
+
+    results = []
+    for name, make_sender in senders:
+        result = run(name, make_sender, frame, args.frames)
+        if name == "packetizer_gso":
+            probe = make_sender(socket.socket(socket.AF_INET, socket.SOCK_DGRAM), ("127.0.0.1", 9))
+            result["gso"] = probe.use_gso
+            probe.sock.close()
+        results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
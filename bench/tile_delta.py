@@ -0,0 +1,99 @@
+# Дельты из плиток против целых JPEG на синтетической кормушке: неподвижный
+# фон с шумом камеры и "птица", которая ходит по небольшой части кадра.
+# Считаем байты на кадр, время сжатия у клиента и PSNR того, что отдаст сервер.
+# Запуск: python bench/tile_delta.py [--frames 300] [--quality 80] [--tile 64] [--threshold 4]
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "server", "src"))
+
+from frame_ring import FrameRing  # noqa: E402
+from tile_canvas import TileCanvas  # noqa: E402
+
+sys.path.insert(0, os.path.join(ROOT, "client", "src"))
+
+from tiles import TileEncoder  # noqa: E402
+
+
+def scene(frames, width=640, height=480, seed=0):
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 6)
+    background = cv2.normalize(background, None, 0, 255, cv2.NORM_MINMAX)
+    for i in range(frames):
+        image = cv2.add(background, rng.integers(0, 3, background.shape, dtype=np.uint8))
+        x = 200 + int(60 * np.sin(i / 15))
+        y = 260 + int(20 * np.cos(i / 10))
+        cv2.ellipse(image, (x, y), (40, 25), i % 360, 0, 360, (40, 90, 160), -1)
+        cv2.circle(image, (x + 35, y - 15), 12, (30, 60, 120), -1)
+        yield image
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return 10 * np.log10(255 ** 2 / mse) if mse else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--tile", type=int, default=64)
+    parser.add_argument("--keyframe", type=float, default=2.0)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--threshold", type=float, default=4)
+    args = parser.parse_args()
+
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), args.quality]
+    encoder = TileEncoder(args.tile, args.keyframe, args.threshold, 0.5)
+    ring = FrameRing(4)
+    executor = ThreadPoolExecutor(1)
+    canvas = TileCanvas(ring, executor, 90, lambda: None)
+
+    full = {"bytes": 0, "encode_s": 0.0, "psnr": []}
+    delta = {"bytes": 0, "encode_s": 0.0, "psnr": [], "keyframes": 0}
+    for i, image in enumerate(scene(args.frames)):
+        started = time.perf_counter()
+        jpeg = cv2.imencode('.jpg', image, params)[1]
+        full["encode_s"] += time.perf_counter() - started
+        full["bytes"] += len(jpeg)
+        full["psnr"].append(psnr(image, cv2.imdecode(jpeg, cv2.IMREAD_COLOR)))
+
+        started = time.perf_counter()
+        key_id = encoder.key_id
+        data = encoder.encode(image, args.quality, now=i / args.fps)
+        delta["encode_s"] += time.perf_counter() - started
+        delta["bytes"] += len(data)
+        delta["keyframes"] += encoder.key_id != key_id
+        canvas.submit(memoryview(data))
+        executor.submit(lambda: None).result()  # Ждём, пока холст обработает кадр
+        shown = cv2.imdecode(np.frombuffer(ring.latest().data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        delta["psnr"].append(psnr(image, shown))
+
+    results = []
+    for name, r in (("full_jpeg", full), ("tile_delta", delta)):
+        result = {
+            "mode": name,
+            "bytes_per_frame": round(r["bytes"] / args.frames),
+            "kbps_at_fps": round(r["bytes"] * 8 / 1000 / (args.frames / args.fps)),
+            "client_ms_per_frame": round(r["encode_s"] / args.frames * 1000, 2),
+            "psnr_mean_db": round(float(np.mean(r["psnr"])), 2),
+            "psnr_min_db": round(float(np.min(r["psnr"])), 2),
+        }
+        if "keyframes" in r:
+            result["keyframes"] = r["keyframes"]
+            result["dropped"] = canvas.dropped
+        results.append(result)
+    results[1]["bytes_ratio"] = round(delta["bytes"] / full["bytes"], 3)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import logging
+import threading
+
+
+# Подстройка качества под канал по отчётам сервера ("stats loss=... done=...").
+# При перегрузке сначала снижаем качество JPEG, потом разрешение и только
+# потом частоту кадров; при чистом канале возвращаем в обратном порядке.
+# Цель - как можно больше доставленных кадров в секунду.
+class BitrateController:
+    def __init__(self, quality, fps, quality_min, fps_min, scale_min,
+                 loss_high, loss_low, done_low, up_after):
+        self.quality_max = quality
+        self.fps_max = fps
+        self.quality_min = quality_min
+        self.fps_min = fps_min
+        self.scale_min = scale_min
+        self.loss_high = loss_high
+        self.loss_low = loss_low
+        self.done_low = done_low
+        self.up_after = up_after  # Сколько чистых отчётов подряд нужно для повышения
+
+        self.quality = quality
+        self.scale = 1.0
+        self.fps = fps
+        self._clean_reports = 0
+        self._lock = threading.Lock()
+
+    def settings(self):
+        with self._lock:
+            return self.quality, self.scale, self.fps
+
+    # Отчёт сервера в виде {"loss": 0.03, "done": 0.9, ...}
+    def update(self, report):
+        loss = report.get("loss", 0.0)
+        done = report.get("done", 1.0)
+        with self._lock:
+            before = (self.quality, self.scale, self.fps)
+            if loss > self.loss_high or done < self.done_low:
+                self._clean_reports = 0
+                self._step_down()
+            elif loss < self.loss_low and done >= 1 - self.loss_low:
+                self._clean_reports += 1
+                if self._clean_reports >= self.up_after:
+                    self._clean_reports = 0
+                    self._step_up()
+            else:
+                self._clean_reports = 0
+            after = (self.quality, self.scale, self.fps)
+        if after != before:
+            logging.info(f"Битрейт: качество {after[0]}, масштаб {after[1]:.2f}, "
+                         f"FPS {after[2]} (потери {loss:.1%}, собрано {done:.1%})")
+
+    def _step_down(self):
+        if self.quality > self.quality_min:
+            self.quality = max(self.quality_min, self.quality - 10)
+        elif self.scale > self.scale_min:
+            self.scale = max(self.scale_min, round(self.scale * 0.8, 2))
+        elif self.fps > self.fps_min:
+            self.fps = max(self.fps_min, int(self.fps * 0.75))
+
+    def _step_up(self):
+        if self.fps < self.fps_max:
+            self.fps = min(self.fps_max, self.fps + 2)
+        elif self.scale < 1.0:
+            self.scale = min(1.0, round(self.scale / 0.8, 2))
+        elif self.quality < self.quality_max:
+            self.quality = min(self.quality_max, self.quality + 5)
+
+
+# Разбор "stats loss=0.031 done=0.950 fps=28.4 kbps=2400" в словарь
+def parse_stats(command):
+    report = {}
+    for item in command.split()[1:]:
+        key, _, value = item.partition('=')
+        report[key] = float(value)
+    return report
@@ -1,6 +1,69 @@
 ID_DEVICE = "TEST"
 
 MTU_SIZE = 1400
+# Датаграмма больше этого не влезает в кадр Ethernet (1500 минус заголовки
+# IP и UDP) и фрагментируется. Под подпись в метаданных остаётся
+# MAX_DATAGRAM - MTU_SIZE - 25 байт, длинный ID_DEVICE обрезается
+MAX_DATAGRAM = 1472
 RECEIVE_PORT = 50006
 JPEG_QUALITY = 80
-FPS=31
\ No newline at end of file
+FPS=31
+
+# Камера сама отдаёт MJPEG, кадры уходят без декодирования и пересжатия.
+# Подпись с ID и временем передаётся в метаданных пакета, сервер наносит её
+# только по запросу зрителя. Качество и размер кадра тогда задаёт камера,
+# регулятор битрейта меняет только FPS. Если камера не умеет MJPEG - обычный режим
+MJPEG_PASSTHROUGH = False
+
+# Пропуск кадров без движения: пока сцена неподвижна, отправляется только
+# кадр-пульс раз в 1/KEEPALIVE_FPS сек (должно быть меньше IDLE_TIMEOUT сервера)
+MOTION_GATE = True
+MOTION_THRESHOLD = 15  # На сколько уровней яркости (0..255) должна измениться точка
+MOTION_AREA = 0.005  # Доля изменившихся точек, чтобы считать это движением
+MOTION_HOLD = 3.0  # Сколько секунд после движения ещё шлём полный FPS
+MOTION_ALPHA = 0.1  # Скорость подстройки фона
+MOTION_SIZE = (64, 48)  # До какого размера уменьшаем кадр для сравнения
+KEEPALIVE_FPS = 0.5
+
+# Дельты из плиток: шлём только изменившиеся с опорного кадра плитки
+# DELTA_TILE x DELTA_TILE точек, опорный кадр целиком - раз в
+# KEYFRAME_INTERVAL сек. Сжатие тогда всегда идёт в потоке (у кодировщика
+# есть состояние), в режиме MJPEG без пересжатия дельты не используются
+DELTA_MODE = False
+DELTA_TILE = 64  # Кратно 16, чтобы границы плиток совпадали с блоками JPEG
+DELTA_THRESHOLD = 4  # Средняя разница яркости в плитке, 0..255
+DELTA_MAX_CHANGED = 0.5  # Если изменилось больше этой доли плиток - шлём опорный кадр
+KEYFRAME_INTERVAL = 2.0
+
+# Где сжимать кадры: "thread" - отдельный поток (cv2 отпускает GIL),
+# "process" - отдельный процесс, чтобы захват, сжатие и отправка шли на разных ядрах
+ENCODE_WORKER = "thread"
+
+# Отправка пакетов: до PACKET_BATCH пакетов одним системным вызовом (UDP GSO,
+# если ядро умеет), PACING_KBPS - ограничение скорости всплеска, 0 - без него
+PACKET_BATCH = 32
+PACING_KBPS = 0
+USE_GSO = True
+
+# Помехоустойчивое кодирование: один пакет чётности (XOR) на FEC_GROUP
+# пакетов кадра, т.е. избыточность 1/FEC_GROUP. 0 - выключено, старый заголовок.
+# Включать (например, 10) только с сервером, который понимает новый заголовок
+FEC_GROUP = 0
+
+# Повторная отправка потерянных пакетов по запросу сервера (nack)
+RETRANSMIT_CACHE = 4  # Сколько последних кадров храним для повтора
+RETRANSMIT_DEADLINE = 0.25  # Старше этого (сек) кадр уже не успеет показаться
+
+# Подстройка битрейта по отчётам сервера. JPEG_QUALITY и FPS - верхние границы
+ADAPTIVE_BITRATE = True
+JPEG_QUALITY_MIN = 30
+FPS_MIN = 5
+SCALE_MIN = 0.5  # Минимальная доля от разрешения камеры
+LOSS_HIGH = 0.05  # Потери выше - снижаем битрейт
+LOSS_LOW = 0.01  # Потери ниже - можно повышать
+DONE_LOW = 0.9  # Доля собранных кадров ниже - снижаем битрейт
+UP_AFTER = 3  # Сколько чистых отчётов подряд перед повышением
+
+# Команды сервера (server/src/commands.py) подтверждаются, сервер повторяет
+# неподтверждённые - уже выполненные номера помним, чтобы не выполнить дважды
+DONE_COMMANDS = 64  # Сколько последних команд помним
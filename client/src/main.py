@@ -6,7 +6,21 @@ import threading
 import sys
 import time
 import logging
-from config import MTU_SIZE, ID_DEVICE, JPEG_QUALITY, FPS, RECEIVE_PORT
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from config import (MTU_SIZE, MAX_DATAGRAM, ID_DEVICE, JPEG_QUALITY, FPS, RECEIVE_PORT, FEC_GROUP,
+                    RETRANSMIT_CACHE, RETRANSMIT_DEADLINE, ADAPTIVE_BITRATE,
+                    JPEG_QUALITY_MIN, FPS_MIN, SCALE_MIN, LOSS_HIGH, LOSS_LOW,
+                    DONE_LOW, UP_AFTER, ENCODE_WORKER, PACKET_BATCH, PACING_KBPS,
+                    USE_GSO, MJPEG_PASSTHROUGH, MOTION_GATE, MOTION_THRESHOLD,
+                    MOTION_AREA, MOTION_HOLD, MOTION_ALPHA, MOTION_SIZE, KEEPALIVE_FPS,
+                    DELTA_MODE, DELTA_TILE, DELTA_THRESHOLD, DELTA_MAX_CHANGED,
+                    KEYFRAME_INTERVAL, DONE_COMMANDS)
+from bitrate import BitrateController, parse_stats
+from pipeline import LatestSlot
+from packetizer import Packetizer, pack_meta, max_label, FLAG_IDLE, FLAG_DELTA
+from motion import MotionGate
+from tiles import TileEncoder
 from threading import Event
 
 # Настройка логов чтобы видеть ошибки
@@ -16,18 +30,27 @@ logging.basicConfig(
     datefmt='%H:%M:%S'
 )
 
-# Задержка между кадрами (вычисляем из FPS)
-DELAY = 1 / FPS
-
 # Общие переменные между потоками (с блокировками!)
-frame = None  # Текущий кадр с камеры
-frame_lock = threading.Lock()  # Замок для кадра
+# Конвейер: захват -> captured -> сжатие -> encoded -> отправка
+captured = LatestSlot()  # Последний кадр с камеры: (картинка или JPEG, время съёмки)
+encoded = LatestSlot()  # Последний сжатый кадр: (JPEG, метаданные, флаги)
+passthrough = False  # Камера отдаёт готовый MJPEG (см. MJPEG_PASSTHROUGH)
 now_time = "NONE 00:00:00"  # Текущее время для надписи
 now_time_lock = threading.Lock()  # Замок для времени
 stop_event = Event()  # Событие для остановки потоков
+packetizer = None  # Отправка пакетов на сервер, через него же идут повторы
+sent_frames = OrderedDict()  # Последние отправленные кадры {номер: (время, данные, метаданные, флаги)}
+sent_frames_lock = threading.Lock()
+bitrate = BitrateController(JPEG_QUALITY, FPS, JPEG_QUALITY_MIN, FPS_MIN, SCALE_MIN,
+                            LOSS_HIGH, LOSS_LOW, DONE_LOW, UP_AFTER)
+motion_gate = MotionGate(MOTION_THRESHOLD, MOTION_AREA, MOTION_HOLD, KEEPALIVE_FPS,
+                         MOTION_ALPHA, MOTION_SIZE) if MOTION_GATE else None
+tile_encoder = TileEncoder(DELTA_TILE, KEYFRAME_INTERVAL, DELTA_THRESHOLD,
+                           DELTA_MAX_CHANGED) if DELTA_MODE else None
 
 # Поток для обновления времени каждую секунду
 def get_time():
+    global now_time
     logging.info("Поток получения настоящего времени успешно запущен.")
     while not stop_event.is_set():
         t = time.localtime()
@@ -35,25 +58,54 @@ def get_time():
             now_time = time.strftime("%H:%M:%S", t)
         time.sleep(1)
 
-# Поток для захвата видео с камеры
+# Кадр от камеры в режиме без перекодирования - сырой буфер с JPEG внутри
+def is_jpeg(frame):
+    return frame is not None and frame.ndim <= 2 and frame.size > 2 \
+        and frame.flat[0] == 0xFF and frame.flat[1] == 0xD8
+
+# Поток для захвата видео с камеры. Темп задаёт сама камера (cap.read ждёт кадр)
 def get_video():
+    global passthrough
     logging.info("Поток получения видео с камеры успешно запущен.")
-    global frame
     cap = cv2.VideoCapture(0)
     cap.set(cv2.CAP_PROP_FPS, FPS)
     if not cap.isOpened():
         logging.error("Камера не работает! Проверь подключение.")
         sys.exit(1)
 
+    if MJPEG_PASSTHROUGH:
+        # Просим MJPEG и отключаем декодирование на стороне OpenCV
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
     _ , current_frame = cap.read()
 
+    if MJPEG_PASSTHROUGH:
+        passthrough = is_jpeg(current_frame)
+        if passthrough:
+            logging.info("Камера отдаёт MJPEG, кадры отправляются без пересжатия.")
+        else:
+            logging.warning("Камера не отдаёт MJPEG, сжимаем кадры сами.")
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            _ , current_frame = cap.read()
+
+    if passthrough:
+        # Надпись рисует сервер по метаданным, кадр не трогаем
+        while not stop_event.is_set():
+            ret, current_frame = cap.read()
+            if not ret or not is_jpeg(current_frame):
+                logging.error("Не могу прочитать кадр! Камера сломалась?")
+                cap.release()
+                sys.exit(1)
+            captured.put((current_frame.reshape(-1), time.time()))
+        return
+
     # Рассчитываем позицию текста один раз
     text = f"{ID_DEVICE} 00:00:00"  # Шаблон
     (text_width, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
     x = (current_frame.shape[1] - text_width) // 16
     y = 30
 
-    next_frame = time.time() + DELAY
     while not stop_event.is_set():
         # Читаем кадр и добавляем текст
         ret, current_frame = cap.read()
@@ -72,15 +124,85 @@ def get_video():
             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA
         )
 
-        # Сохраняем кадр с блокировкой
-        with frame_lock:
-            frame = frame_with_text
+        # Отдаём кадр на сжатие, несжатый предыдущий просто заменяется
+        captured.put((frame_with_text, time.time()))
+
+# Сжатие кадра с настройками регулятора битрейта (может работать в другом процессе)
+def encode_frame(image, quality, scale):
+    if scale < 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    success, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not success:
+        return None
+    return buffer.reshape(-1)  # Буфер кодировщика режется на пакеты без копирования
 
+# Поток сжатия: в темпе текущего FPS берёт самый свежий кадр с камеры.
+# Каждый кадр сжимается не больше одного раза, пропущенные просто выбрасываются.
+def encode_video():
+    logging.info("Поток сжатия видео успешно запущен.")
+    executor = ProcessPoolExecutor(1) if ENCODE_WORKER == "process" and not DELTA_MODE else None
+    last_seq = 0
+    next_frame = time.time()
+    label_limit = max_label(MTU_SIZE, MAX_DATAGRAM)
+    if MJPEG_PASSTHROUGH and len(ID_DEVICE.encode()) > label_limit:
+        logging.warning(f"ID_DEVICE длиннее {label_limit} байт, в метаданных кадра он будет обрезан.")
+    try:
+        while not stop_event.is_set():
             time.sleep(max(0, next_frame - time.time()))
-            next_frame += DELAY
+            last_seq, item = captured.get(last_seq, timeout=1)
+            if item is None:
+                continue  # Камера ещё не дала новый кадр
+            image, captured_at = item
+
+            # Неподвижную сцену не сжимаем и не отправляем, кроме редкого пульса
+            flags = 0
+            if motion_gate is not None:
+                if not motion_gate.check(image, time.time()):
+                    continue
+                if not motion_gate.active:
+                    flags = FLAG_IDLE
+
+            quality, scale, fps = bitrate.settings()
+            if passthrough:
+                # Кадр уже сжат камерой, от регулятора берём только FPS
+                encoded.put((image, pack_meta(captured_at, ID_DEVICE, label_limit), flags))
+                next_frame = max(next_frame + 1 / fps, time.time())
+                continue
+            if tile_encoder is not None:
+                if scale < 1.0:
+                    image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                data = tile_encoder.encode(image, quality)
+                flags |= FLAG_DELTA
+            elif executor:
+                data = executor.submit(encode_frame, image, quality, scale).result()
+            else:
+                data = encode_frame(image, quality, scale)
+            if data is None:
+                logging.warning("Не смог сжать кадр в JPEG!")
+                continue
+
+            encoded.put((data, b'', flags))
+            next_frame = max(next_frame + 1 / fps, time.time())
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+# Повторная отправка пакетов кадра seq, отмеченных в битовой карте сервера
+def retransmit(seq, bitmap):
+    with sent_frames_lock:
+        entry = sent_frames.get(seq)
+    if entry is None or packetizer is None:
+        return
+    sent_time, data, meta, flags = entry
+    if time.time() - sent_time > RETRANSMIT_DEADLINE:
+        return  # Кадр уже не успеет показаться, не тратим канал
+
+    missing = [i for i in range(len(bitmap) * 8) if bitmap[i >> 3] & (1 << (i & 7))]
+    packetizer.resend(seq, data, missing, meta, flags)
 
 # Поток для отправки видео через UDP
 def send_video(ip, port):
+    global packetizer
     logging.info("Поток отправки видео на сервер успешно запущен.")
     server_address = (ip, port)
 
@@ -88,49 +210,29 @@ def send_video(ip, port):
         # Создаем UDP-сокет с таймаутом
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.settimeout(5)
+        packetizer = Packetizer(sock, server_address, MTU_SIZE, FEC_GROUP,
+                                PACKET_BATCH, PACING_KBPS, USE_GSO)
 
         packet_seq = 0  # Счетчик пакетов
-
-        next_frame = time.time() + DELAY
+        last_encoded = 0
 
         while not stop_event.is_set():
-            # Берем текущий кадр с блокировкой
-            with frame_lock:
-                current_frame = frame
-
-            if current_frame is None:
-                continue  # Пропускаем если кадра нет
-
-            # Конвертируем в JPEG
-            success, buffer = cv2.imencode(
-                '.jpg', current_frame,
-                [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
-            )
-            if not success:
-                logging.warning("Не смог сжать кадр в JPEG!")
+            # Ждём новый сжатый кадр, без опроса вхолостую
+            last_encoded, item = encoded.get(last_encoded, timeout=1)
+            if item is None:
                 continue
+            data, meta, flags = item
 
-            data = buffer.tobytes()
-            total_packets = (len(data) + MTU_SIZE - 1) // MTU_SIZE
-
-            # Отправляем все пакеты кадра
-            for i in range(total_packets):
-                start = i * MTU_SIZE
-                end = start + MTU_SIZE
-                chunk = data[start:end]
+            # Запоминаем кадр на случай запроса потерянных пакетов
+            with sent_frames_lock:
+                sent_frames[packet_seq] = (time.time(), data, meta, flags)
+                while len(sent_frames) > RETRANSMIT_CACHE:
+                    sent_frames.popitem(last=False)
 
-                # Собираем заголовок:
-                # 4 байта - номер кадра, 2 - номер пакета, 2 - всего пакетов
-                header = (
-                    packet_seq.to_bytes(4, 'big') +
-                    i.to_bytes(2, 'big') +
-                    total_packets.to_bytes(2, 'big')
-                )
-                sock.sendto(header + chunk, server_address)
+            # Отправляем все пакеты кадра (и чётность, если включён FEC)
+            packetizer.send_frame(packet_seq, data, meta, flags)
 
             packet_seq = (packet_seq + 1) % 2**32  # Чтобы не переполнилось
-            time.sleep(max(0, next_frame - time.time()))
-            next_frame += DELAY
 
     except socket.timeout:
         logging.warning("Таймаут отправки. Переподключение...")
@@ -141,11 +243,31 @@ def send_video(ip, port):
     finally:
         sock.close()
 
+# Выполнение команды сервера, возвращает статус для подтверждения:
+# ok - выполнена, unknown - такой команды нет
+def run_command(command):
+    logging.info(f"Получена команда: {command}")
+
+    # Обработка команд от авторизованного IP
+    if command == "stop":
+        logging.info("Получена команда остановки")
+        stop_event.set()  # Устанавливаем событие остановки
+        return "ok"
+
+    if command == "donate":
+        logging.info("Получена команда доната")
+        # Здесь можно добавить код для обработки доната
+        return "ok"
+
+    logging.warning(f"Неизвестная команда: {command}")
+    return "unknown"
+
 def receive_commands(ip, port):
     logging.info("Поток приема команд успешно запущен.")
     command_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     command_socket.bind(('', port))
     authorized_ip = ip  # Сохраняем разрешенный IP
+    done_commands = OrderedDict()  # {(порт сервера, id): статус} последних команд
             
     try:
         while not stop_event.is_set():
@@ -157,20 +279,54 @@ def receive_commands(ip, port):
                 continue
                     
             command = data.decode().strip()
-            logging.info(f"Получена команда: {command}")
-                    
-            # Обработка команд от авторизованного IP
-            if command == "stop":
-                logging.info("Получена команда остановки")
-                stop_event.set()  # Устанавливаем событие остановки
+
+            # Отчёт сервера о качестве канала
+            if command.startswith("stats "):
+                if ADAPTIVE_BITRATE:
+                    try:
+                        bitrate.update(parse_stats(command))
+                    except ValueError:
+                        logging.warning(f"Неправильный stats: {command}")
+                continue
+
+            # Запрос потерянных пакетов: "nack <номер кадра> <битовая карта hex>"
+            if command.startswith("nack "):
+                try:
+                    _, seq, bitmap = command.split()
+                    retransmit(int(seq), bytes.fromhex(bitmap))
+                except ValueError:
+                    logging.warning(f"Неправильный nack: {command}")
+                continue
+
+            # Сервер потерял опорный кадр дельт
+            if command == "keyframe":
+                if tile_encoder is not None:
+                    tile_encoder.force_keyframe()
+                continue
+
+            # Команда с подтверждением: "cmd <id> <команда>", отвечаем
+            # "ack <id> <статус>". Повтор (сервер не получил ack) не выполняем
+            # второй раз. id уникален для сокета сервера, поэтому ключ - с портом.
+            if command.startswith("cmd "):
+                try:
+                    _, command_id, command = command.split(maxsplit=2)
+                except ValueError:
+                    logging.warning(f"Неправильная команда: {command}")
+                    continue
+                key = (addr[1], command_id)
+                status = done_commands.get(key)
+                if status is None:
+                    status = run_command(command)
+                    done_commands[key] = status
+                    if len(done_commands) > DONE_COMMANDS:
+                        done_commands.popitem(last=False)
+                command_socket.sendto(f"ack {command_id} {status}".encode(), addr)
+            else:
+                run_command(command)
+
+            if stop_event.is_set():
                 sys.exit(0)
-            
-            if command == "donate":
-                logging.info("Получена команда доната")
-                # Здесь можно добавить код для обработки доната
-                pass
-                
-                        
+
     except Exception as e:
         logging.error(f"Ошибка приема команд: {e}")
     finally:
@@ -196,6 +352,7 @@ if __name__ == "__main__":
     threads = [
         threading.Thread(target=get_time),
         threading.Thread(target=get_video),
+        threading.Thread(target=encode_video),
         threading.Thread(target=send_video, args=(ip, port)),
         threading.Thread(target=receive_commands, args=(ip, RECEIVE_PORT))
     ]
@@ -0,0 +1,66 @@
+import logging
+
+import cv2
+import numpy as np
+
+
+# Маленькая серая копия кадра для сравнения. Кадр - картинка BGR или
+# (в режиме MJPEG без пересжатия) буфер JPEG, который декодируем сразу в 1/8
+def downscale_gray(image, size):
+    if image.ndim == 1:
+        gray = cv2.imdecode(image, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if gray is None:
+            return None
+    else:
+        gray = cv2.cvtColor(cv2.resize(image, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    if (gray.shape[1], gray.shape[0]) != size:
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+# Пропуск кадров, пока в кормушке ничего не происходит. Уменьшенный серый
+# кадр сравнивается с фоном (скользящее среднее прошлых кадров): если
+# изменилось больше area от всех точек, сцена активна. Пока активна и ещё
+# hold секунд после - пропускаем все кадры, иначе один кадр-пульс в
+# 1/keepalive_fps секунд, чтобы сервер видел, что клиент жив.
+class MotionGate:
+    def __init__(self, threshold, area, hold, keepalive_fps, alpha, size):
+        self.threshold = threshold  # Насколько (0..255) должна измениться точка
+        self.area = area  # Доля изменившихся точек, 0..1
+        self.hold = hold
+        self.keepalive = 1 / keepalive_fps
+        self.alpha = alpha  # Скорость обновления фона
+        self.size = size
+        self.active = True
+        self._background = None
+        self._last_motion = 0.0
+        self._last_sent = 0.0
+
+    # Отправлять ли кадр. Вызывается из одного потока сжатия
+    def check(self, image, now):
+        gray = downscale_gray(image, self.size)
+        if gray is None:
+            return True  # Не смогли проверить - лучше отправить
+        gray = gray.astype(np.float32)
+
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray
+            motion = True
+        else:
+            diff = np.abs(gray - self._background)
+            motion = np.count_nonzero(diff > self.threshold) > self.area * diff.size
+            # Фон медленно подстраивается под свет и под то, что осталось лежать
+            self._background += self.alpha * (gray - self._background)
+
+        if motion:
+            self._last_motion = now
+        active = now - self._last_motion < self.hold
+        if active != self.active:
+            self.active = active
+            logging.info("В кадре движение, полный FPS." if active
+                         else "Сцена неподвижна, шлём только пульс.")
+
+        if active or now - self._last_sent >= self.keepalive:
+            self._last_sent = now
+            return True
+        return False
@@ -0,0 +1,199 @@
+import logging
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+# Старый заголовок: номер кадра, номер пакета, всего пакетов
+LEGACY_HEADER = struct.Struct('!IHH')
+# Расширенный заголовок пакета (разбирается в server/src/protocol.py):
+# номер кадра, номер пакета, всего пакетов | EXT_FLAG, версия, тип пакета,
+# размер группы FEC, флаги, размер кадра в байтах
+EXT_HEADER = struct.Struct('!IHHBBBBI')
+EXT_FLAG = 0x8000
+PROTOCOL_VERSION = 1
+KIND_DATA = 0
+KIND_PARITY = 1
+FLAG_RETRANSMIT = 0x01  # Пакет отправлен повторно по запросу сервера
+FLAG_META = 0x02  # После заголовка идут метаданные кадра
+FLAG_IDLE = 0x04  # Сцена неподвижна, следующий кадр придёт не скоро
+FLAG_DELTA = 0x08  # Кадр из tiles.TileEncoder: опорный или дельта из плиток
+# Метаданные: время съёмки (unix, сек), длина подписи, подпись в UTF-8
+META_HEADER = struct.Struct('!dB')
+
+# UDP GSO (Linux 4.18+): ядро само режет один большой буфер на датаграммы
+_SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+_UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+_GSO_MAX_SEGMENTS = 64
+_GSO_MAX_BYTES = 65000
+
+
+# Пакеты чётности: XOR каждой группы из fec_group пакетов кадра.
+# Последний пакет дополняется нулями до mtu. Строки результата - пакеты.
+def make_parity(data, mtu, fec_group):
+    total_packets = (len(data) + mtu - 1) // mtu
+    padded = np.zeros(total_packets * mtu, dtype=np.uint8)
+    padded[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    chunks = padded.reshape(total_packets, mtu)
+    return np.bitwise_xor.reduceat(chunks, np.arange(0, total_packets, fec_group), axis=0)
+
+
+# Метаданные повторяются в каждом пакете поверх полного куска mtu, поэтому
+# подпись ограничена тем, что остаётся до max_datagram байт
+def max_label(mtu, max_datagram):
+    return max(0, min(255, max_datagram - EXT_HEADER.size - META_HEADER.size - mtu))
+
+
+# Метаданные кадра вместо надписи на картинке, сервер нанесёт её сам по запросу
+def pack_meta(timestamp, label, limit=255):
+    # Обрезаем по границе символа UTF-8
+    label = label.encode()[:limit].decode(errors='ignore').encode()
+    return META_HEADER.pack(timestamp, len(label)) + label
+
+
+def gso_supported(sock, segment):
+    try:
+        sock.setsockopt(_SOL_UDP, _UDP_SEGMENT, segment)
+        sock.setsockopt(_SOL_UDP, _UDP_SEGMENT, 0)
+        return hasattr(sock, 'sendmsg')
+    except OSError:
+        return False
+
+
+# Нарезка кадра на пакеты без промежуточных объектов: куски - это
+# memoryview буфера кодировщика, заголовки пишутся struct.pack_into прямо в
+# переиспользуемый буфер датаграмм. Если ядро умеет UDP GSO, пачка пакетов
+# уходит одним sendmsg, иначе - sendto на пакет. Пачки можно растянуть во
+# времени (pacing_kbps), чтобы не переполнять очередь Wi-Fi.
+class Packetizer:
+    def __init__(self, sock, address, mtu, fec_group=0, batch=32, pacing_kbps=0, use_gso=True):
+        self.sock = sock
+        self.address = address
+        self.mtu = mtu
+        self.fec_group = fec_group
+        self.pacing = pacing_kbps * 1000 / 8  # байт в секунду, 0 - без ограничения
+        max_segment = EXT_HEADER.size + META_HEADER.size + 255 + mtu
+        self.batch = max(1, min(batch, _GSO_MAX_SEGMENTS, _GSO_MAX_BYTES // max_segment))
+        self.use_gso = use_gso and self.batch > 1 and gso_supported(sock, max_segment)
+
+        self._lock = threading.Lock()  # Повторы идут из потока приёма команд
+        self._packet_buf = bytearray(max_segment)
+        self._packet_view = memoryview(self._packet_buf)
+        self._batch_buf = bytearray(self.batch * max_segment)
+        self._batch_view = memoryview(self._batch_buf)
+        self._batch_pos = 0
+        self._batch_count = 0
+        self._batch_segment = 0  # Размер датаграмм текущей пачки
+        self._batch_closed = False  # В пачке уже есть короткая (последняя) датаграмма
+        self._next_send = 0.0
+
+        # Счётчики для замеров
+        self.packets = 0
+        self.syscalls = 0
+
+    # Отправка кадра целиком: пакеты данных, после каждой группы - её чётность.
+    # meta (pack_meta) и flags повторяются в каждом пакете кадра.
+    def send_frame(self, seq, data, meta=b'', flags=0):
+        view = memoryview(data).cast('B')
+        size = len(view)
+        total = (size + self.mtu - 1) // self.mtu
+        # Без FEC, метаданных и флагов сервер понимает и старый заголовок
+        extended = bool(self.fec_group or meta or flags)
+        parity = make_parity(view, self.mtu, self.fec_group) if self.fec_group else None
+        with self._lock:
+            for i in range(total):
+                self._add(extended, seq, i, total, KIND_DATA, flags, size, meta,
+                          view[i * self.mtu:(i + 1) * self.mtu])
+                if parity is not None and (i % self.fec_group == self.fec_group - 1 or i == total - 1):
+                    group = i // self.fec_group
+                    self._add(extended, seq, group, total, KIND_PARITY, flags, size, meta,
+                              parity[group].data)
+            self._flush()
+        return total + (len(parity) if parity is not None else 0)
+
+    # Повторная отправка отдельных пакетов кадра
+    def resend(self, seq, data, nums, meta=b'', flags=0):
+        view = memoryview(data).cast('B')
+        size = len(view)
+        total = (size + self.mtu - 1) // self.mtu
+        with self._lock:
+            for i in nums:
+                if i < total:
+                    self._add(True, seq, i, total, KIND_DATA, flags | FLAG_RETRANSMIT, size, meta,
+                              view[i * self.mtu:(i + 1) * self.mtu])
+            self._flush()
+
+    def _pack_header(self, buf, pos, extended, seq, num, total, kind, flags, size, meta):
+        if extended:
+            if meta:
+                flags |= FLAG_META
+            EXT_HEADER.pack_into(buf, pos, seq, num, total | EXT_FLAG, PROTOCOL_VERSION,
+                                 kind, self.fec_group, flags, size)
+            pos += EXT_HEADER.size
+            buf[pos:pos + len(meta)] = meta
+            return EXT_HEADER.size + len(meta)
+        LEGACY_HEADER.pack_into(buf, pos, seq, num, total)
+        return LEGACY_HEADER.size
+
+    def _add(self, extended, seq, num, total, kind, flags, size, meta, chunk):
+        if not self.use_gso:
+            # Датаграмма собирается в переиспользуемом буфере: без новых объектов на пакет
+            length = self._pack_header(self._packet_buf, 0, extended, seq, num, total, kind, flags, size, meta)
+            self._packet_buf[length:length + len(chunk)] = chunk
+            length += len(chunk)
+            self.sock.sendto(self._packet_view[:length], self.address)
+            self.packets += 1
+            self.syscalls += 1
+            self._pace(length)
+            return
+
+        # В пачке GSO все датаграммы одного размера, только последняя может быть короче
+        segment = (EXT_HEADER.size + len(meta) if extended else LEGACY_HEADER.size) + len(chunk)
+        if self._batch_count and (self._batch_closed or segment > self._batch_segment):
+            self._flush()
+        if not self._batch_count:
+            self._batch_segment = segment
+        pos = self._batch_pos
+        pos += self._pack_header(self._batch_buf, pos, extended, seq, num, total, kind, flags, size, meta)
+        self._batch_buf[pos:pos + len(chunk)] = chunk
+        self._batch_pos = pos + len(chunk)
+        self._batch_count += 1
+        self._batch_closed = segment < self._batch_segment
+        if self._batch_count >= self.batch:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch_count:
+            return
+        data = self._batch_view[:self._batch_pos]
+        if self._batch_count == 1:
+            self.sock.sendto(data, self.address)
+            self.syscalls += 1
+        else:
+            try:
+                self.sock.sendmsg([data], [(_SOL_UDP, _UDP_SEGMENT, struct.pack('=H', self._batch_segment))],
+                                  0, self.address)
+                self.syscalls += 1
+            except OSError as e:
+                # Проверка setsockopt прошла, а отправить ядро не может (например,
+                # EIO без аппаратной контрольной суммы) - дальше без GSO
+                logging.warning(f"UDP GSO не работает ({e}), отправляем по одному пакету.")
+                self.use_gso = False
+                for pos in range(0, self._batch_pos, self._batch_segment):
+                    self.sock.sendto(data[pos:pos + self._batch_segment], self.address)
+                    self.syscalls += 1
+        self.packets += self._batch_count
+        sent = self._batch_pos
+        self._batch_pos = self._batch_count = 0
+        self._batch_closed = False
+        self._pace(sent)
+
+    def _pace(self, sent_bytes):
+        if not self.pacing:
+            return
+        now = time.perf_counter()
+        self._next_send = max(self._next_send, now) + sent_bytes / self.pacing
+        if self._next_send > now:
+            time.sleep(self._next_send - now)
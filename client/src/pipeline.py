@@ -0,0 +1,31 @@
+import threading
+
+
+# Очередь на один элемент между стадиями конвейера. Новый элемент заменяет
+# непрочитанный старый - устаревшие кадры выбрасываются, а не копятся.
+# Читатель ждёт элемент с номером больше последнего обработанного,
+# поэтому один и тот же кадр не обрабатывается дважды.
+class LatestSlot:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0  # Номер последнего положенного элемента
+        self._read = 0  # Номер последнего забранного элемента
+        self.dropped = 0  # Сколько элементов заменили, не дождавшись читателя
+
+    def put(self, item):
+        with self._cond:
+            if self._seq > self._read:
+                self.dropped += 1
+            self._seq += 1
+            self._item = item
+            self._cond.notify_all()
+            return self._seq
+
+    # Возвращает (номер, элемент) новее after или (after, None) по таймауту
+    def get(self, after, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after, timeout):
+                return after, None
+            self._read = self._seq
+            return self._seq, self._item
@@ -0,0 +1,94 @@
+import struct
+import time
+
+import cv2
+import numpy as np
+
+# Кадр в режиме дельт (разбирается в server/src/tile_canvas.py):
+# тип (0 - опорный, 1 - дельта), номер опорного кадра, ширина, высота,
+# размер плитки, число плиток. За опорным заголовком идёт целый JPEG,
+# за дельтой - плитки: столбец, строка, длина JPEG и сам JPEG.
+DELTA_HEADER = struct.Struct('!BIHHHH')
+TILE_HEADER = struct.Struct('!HHI')
+KIND_KEY = 0
+KIND_DELTA = 1
+
+
+# Дельта-кодирование плитками. Кадр делится на сетку tile x tile точек,
+# плитки сравниваются с последним опорным кадром, отправляются только
+# изменившиеся - маленькими JPEG. Каждая дельта считается от опорного кадра,
+# поэтому потеря дельты портит только один кадр. Опорный кадр (целиком)
+# шлётся раз в keyframe_interval секунд, по запросу сервера и когда
+# изменилась большая часть кадра (max_changed) - тогда он выгоднее дельт.
+class TileEncoder:
+    def __init__(self, tile, keyframe_interval, threshold, max_changed):
+        self.tile = tile
+        self.keyframe_interval = keyframe_interval
+        self.threshold = threshold  # Средняя разница яркости в плитке, 0..255
+        self.max_changed = max_changed  # Доля изменившихся плиток, 0..1
+        self.key_id = 0
+        self._reference = None  # Опорный кадр, с которым сравниваем
+        self._key_time = 0.0
+        self._force = False
+
+    # Сервер потерял опорный кадр - следующий кадр будет опорным
+    def force_keyframe(self):
+        self._force = True
+
+    def encode(self, image, quality, now=None):
+        now = time.time() if now is None else now
+        height, width = image.shape[:2]
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+
+        changed = None
+        if not self._need_keyframe(image, now):
+            changed = self._changed_tiles(image)
+            if len(changed) > self.max_changed * self._tile_count(width, height):
+                changed = None
+
+        if changed is None:
+            success, buffer = cv2.imencode('.jpg', image, params)
+            if not success:
+                return None
+            self.key_id = (self.key_id + 1) % 2**32
+            self._reference = image.copy()
+            self._key_time = now
+            self._force = False
+            return DELTA_HEADER.pack(KIND_KEY, self.key_id, width, height, self.tile, 0) + buffer.tobytes()
+
+        parts = [DELTA_HEADER.pack(KIND_DELTA, self.key_id, width, height, self.tile, len(changed))]
+        for row, col in changed:
+            y, x = row * self.tile, col * self.tile
+            success, buffer = cv2.imencode('.jpg', image[y:y + self.tile, x:x + self.tile], params)
+            if not success:
+                return None
+            parts.append(TILE_HEADER.pack(col, row, len(buffer)))
+            parts.append(buffer.tobytes())
+        return b''.join(parts)
+
+    def _need_keyframe(self, image, now):
+        return (self._force or self._reference is None
+                or self._reference.shape != image.shape
+                or now - self._key_time >= self.keyframe_interval)
+
+    def _tile_count(self, width, height):
+        return -(-width // self.tile) * -(-height // self.tile)
+
+    # (строка, столбец) плиток, где средняя разница с опорным кадром выше порога
+    def _changed_tiles(self, image):
+        height, width = image.shape[:2]
+        rows, cols = -(-height // self.tile), -(-width // self.tile)
+        diff = cv2.absdiff(image, self._reference)
+        if diff.ndim == 3:
+            diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
+        # Края дополняем нулями до целой сетки; при целом коэффициенте
+        # INTER_AREA даёт ровно среднее по каждой плитке
+        diff = cv2.copyMakeBorder(diff, 0, rows * self.tile - height, 0, cols * self.tile - width,
+                                  cv2.BORDER_CONSTANT, value=0)
+        means = cv2.resize(diff.astype(np.float32), (cols, rows), interpolation=cv2.INTER_AREA)
+        # У крайних плиток среднее считаем по части внутри кадра
+        if height % self.tile:
+            means[-1, :] *= self.tile / (height % self.tile)
+        if width % self.tile:
+            means[:, -1] *= self.tile / (width % self.tile)
+        return list(zip(*np.nonzero(means > self.threshold)))
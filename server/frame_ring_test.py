@@ -0,0 +1,56 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from frame_ring import FrameRing
+
+
+class FrameRingTest(unittest.TestCase):
+    def test_wait_wakes_on_append(self):
+        async def scenario():
+            ring = FrameRing()
+            waiter = asyncio.ensure_future(ring.wait(0))
+            await asyncio.sleep(0)
+            frame = ring.append(memoryview(b"jpeg"))
+            await asyncio.wait_for(waiter, 1)
+            return ring, frame
+
+        ring, frame = asyncio.run(scenario())
+        self.assertEqual((frame.id, ring.last_id, bytes(ring.latest().data)), (1, 1, b"jpeg"))
+
+    def test_timed_out_waiters_are_removed(self):
+        async def scenario():
+            ring = FrameRing()
+            await asyncio.gather(*(ring.wait(0, 0.01) for _ in range(10)))
+            return ring
+
+        self.assertEqual(len(asyncio.run(scenario())._waiters), 0)
+
+    def test_cancelled_waiter_is_removed(self):
+        async def scenario():
+            ring = FrameRing()
+            waiter = asyncio.ensure_future(ring.wait(0))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            return ring
+
+        self.assertEqual(len(asyncio.run(scenario())._waiters), 0)
+
+    def test_close_wakes_waiters(self):
+        async def scenario():
+            ring = FrameRing()
+            waiter = asyncio.ensure_future(ring.wait(0))
+            await asyncio.sleep(0)
+            ring.close()
+            await asyncio.wait_for(waiter, 1)
+            return ring
+
+        self.assertTrue(asyncio.run(scenario()).closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
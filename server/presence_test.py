@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from presence import PresenceBus, sse_events
+
+
+class PresenceBusTest(unittest.TestCase):
+    def test_since_and_snapshot(self):
+        bus = PresenceBus(history=2)
+        bus.publish("join", "a:1", "active")
+        bus.publish("state", "a:1", "active")  # Без изменений - не событие
+        bus.publish("join", "b:2", "idle")
+        bus.publish("leave", "a:1")
+        self.assertEqual(bus.snapshot(), (3, {"b:2": "idle"}))
+        self.assertEqual([e.kind for e in bus.since(1)], ["join", "leave"])
+        self.assertIsNone(bus.since(0))  # Вытеснено из истории
+
+    def test_resume_by_event_id(self):
+        bus = PresenceBus()
+        bus.publish("join", "a:1", "active")
+        self.assertEqual(bus.parse_event_id(bus.event_id(1)), 1)
+        self.assertIsNone(bus.parse_event_id("other-1"))
+        self.assertIsNone(bus.parse_event_id(bus.event_id(5)))
+
+        async def first_event():
+            events = sse_events(bus, bus.event_id(0), keepalive=1)
+            bus.publish("join", "b:2", "idle")
+            return await events.__anext__()
+
+        self.assertIn("event: join\ndata: a:1=active", asyncio.run(first_event()))
+
+    def test_keepalive_does_not_leak_waiters(self):
+        async def scenario():
+            bus = PresenceBus()
+            await asyncio.gather(*(bus.wait(0, 0.01) for _ in range(10)))
+            return bus
+
+        self.assertEqual(len(asyncio.run(scenario())._waiters), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from protocol import (EXT_FLAG, EXT_HEADER, KIND_DATA, KIND_PARITY, LEGACY_HEADER, VERSION,
+                      FLAG_RETRANSMIT, parse_packet)
+from reassembler import FrameReassembler, SEQ_MOD, seq_diff
+
+MTU = 8
+
+
+def chunks(data):
+    return [data[i:i + MTU] for i in range(0, len(data), MTU)]
+
+
+def legacy_packets(seq, data):
+    parts = chunks(data)
+    return [parse_packet(LEGACY_HEADER.pack(seq, n, len(parts)) + part) for n, part in enumerate(parts)]
+
+
+def ext_packet(seq, num, total, kind, fec_k, payload, size, flags=0):
+    header = EXT_HEADER.pack(seq, num, total | EXT_FLAG, VERSION, kind, fec_k, flags, size)
+    return parse_packet(header + payload)
+
+
+# Пакеты данных и чётности кадра, как их шлёт client/src/packetizer.py
+def fec_packets(seq, data, fec_k):
+    parts = chunks(data)
+    total = len(parts)
+    data_packets = [ext_packet(seq, n, total, KIND_DATA, fec_k, part, len(data))
+                    for n, part in enumerate(parts)]
+    parity_packets = []
+    for group in range(0, total, fec_k):
+        acc = bytearray(MTU)
+        for part in parts[group:group + fec_k]:
+            for i, b in enumerate(part):
+                acc[i] ^= b
+        parity_packets.append(ext_packet(seq, group // fec_k, total, KIND_PARITY, fec_k,
+                                         bytes(acc), len(data)))
+    return data_packets, parity_packets
+
+
+class SeqDiffTest(unittest.TestCase):
+    def test_wrap(self):
+        self.assertEqual(seq_diff(0, SEQ_MOD - 1), 1)
+        self.assertEqual(seq_diff(SEQ_MOD - 1, 0), -1)
+        self.assertEqual(seq_diff(5, 3), 2)
+
+
+class FrameReassemblerTest(unittest.TestCase):
+    def setUp(self):
+        self.r = FrameReassembler(MTU, slots=2, max_packets=16, spare_buffers=4)
+
+    def add_all(self, packets):
+        frame = None
+        for packet in packets:
+            result = self.r.add(packet)
+            if result is not None:
+                self.assertIsNone(frame, "кадр собран дважды")
+                frame = result
+        return frame
+
+    def test_out_of_order(self):
+        data = bytes(range(30))
+        frame = self.add_all(reversed(legacy_packets(1, data)))
+        self.assertEqual(bytes(frame), data)
+        self.assertEqual(self.r.completed, 1)
+
+    def test_duplicate_and_stale(self):
+        packets = legacy_packets(1, b"a" * 20)
+        self.assertIsNone(self.r.add(packets[0]))
+        self.assertIsNone(self.r.add(packets[0]))
+        self.assertEqual(self.r.duplicates, 1)
+        self.add_all(packets[1:])
+        self.assertIsNone(self.r.add(packets[0]))
+        self.assertEqual(self.r.stale, 1)
+
+    def test_sequence_wrap(self):
+        first = self.add_all(legacy_packets(SEQ_MOD - 1, b"x" * 10))
+        second = self.add_all(legacy_packets(0, b"y" * 10))
+        self.assertEqual(bytes(first), b"x" * 10)
+        self.assertEqual(bytes(second), b"y" * 10)
+        self.assertEqual(self.r.stale, 0)
+
+    def test_newer_frame_evicts_older(self):
+        old = legacy_packets(1, b"o" * 20)
+        self.r.add(old[0])
+        self.assertEqual(bytes(self.add_all(legacy_packets(2, b"n" * 20))), b"n" * 20)
+        self.assertEqual(self.r.evicted, 1)
+        self.assertIsNone(self.r.add(old[1]))
+
+    def test_restart(self):
+        self.add_all(legacy_packets(1000, b"a" * 10))
+        self.assertEqual(bytes(self.add_all(legacy_packets(0, b"b" * 10))), b"b" * 10)
+
+    def test_extended_header(self):
+        packet = ext_packet(7, 1, 3, KIND_DATA, 0, b"z" * MTU, 20, FLAG_RETRANSMIT)
+        self.assertEqual((packet.seq, packet.num, packet.total, packet.kind), (7, 1, 3, KIND_DATA))
+        self.assertEqual(packet.frame_size, 20)
+        self.assertEqual(bytes(packet.payload), b"z" * MTU)
+        self.r.add(packet)
+        self.assertEqual(self.r.retransmitted, 1)
+
+    def test_malformed(self):
+        self.assertIsNone(self.r.add(parse_packet(LEGACY_HEADER.pack(1, 0, 2) + b"short")))
+        self.assertIsNone(self.r.add(parse_packet(LEGACY_HEADER.pack(1, 5, 2) + b"x" * MTU)))
+        self.assertEqual(self.r.malformed, 2)
+
+    def test_fec_recovers_lost_packet(self):
+        data = bytes(range(1, 31))  # Последний пакет короткий
+        for lost in range(4):
+            with self.subTest(lost=lost):
+                r = self.r = FrameReassembler(MTU, 2, 16)
+                data_packets, parity_packets = fec_packets(1, data, 2)
+                frame = self.add_all([p for n, p in enumerate(data_packets) if n != lost] + parity_packets)
+                self.assertEqual(bytes(frame), data)
+                self.assertEqual((r.fec_packets, r.fec_frames), (1, 1))
+
+    def test_nack_skips_groups_fec_can_rebuild(self):
+        data = bytes(range(1, 49))  # 6 пакетов, группы по 2
+        data_packets, _ = fec_packets(1, data, 2)
+        # Группа 0 без одного пакета, группа 1 без обоих, группа 2 целая
+        for n in (1, 4, 5):
+            self.r.add(data_packets[n])
+        now = self.r.pending()[0].last_time
+        first = self.r.nack_candidates(now + 0.02, 0.01, 0.03, 1.0, 3)
+        self.assertEqual(first, [(1, bytes([0b00001100]))])
+        # Чётность группы 0 не пришла - следующий запрос включает и её
+        self.assertEqual(self.r.nack_candidates(now + 0.04, 0.01, 0.03, 1.0, 3), [])
+        second = self.r.nack_candidates(now + 0.06, 0.01, 0.03, 1.0, 3)
+        self.assertEqual(second, [(1, bytes([0b00001101]))])
+        self.assertEqual(self.r.nacked, 5)
+
+    def test_nack_waits_for_parity_only(self):
+        data_packets, _ = fec_packets(1, bytes(range(1, 33)), 2)
+        for n in (0, 2, 3):
+            self.r.add(data_packets[n])
+        now = self.r.pending()[0].last_time
+        self.assertEqual(self.r.nack_candidates(now + 0.02, 0.01, 0.03, 1.0, 1), [])
+        self.assertEqual(self.r.nack_candidates(now + 0.06, 0.01, 0.03, 1.0, 1), [(1, bytes([0b10]))])
+
+    def test_buffer_reused_after_release(self):
+        frames = [self.add_all(legacy_packets(seq, bytes([seq]) * 20)) for seq in range(1, 4)]
+        buffers = {id(frame.obj) for frame in frames}
+        self.assertEqual(len(buffers), 3)  # На все кадры есть ссылки - буферы новые
+        oldest = id(frames[0].obj)
+        frames = frames[1:]
+        frame = self.add_all(legacy_packets(4, b"\x04" * 20))
+        self.assertEqual(id(frame.obj), oldest)
+        self.assertEqual(bytes(frame), b"\x04" * 20)
+        self.assertEqual([bytes(f) for f in frames], [b"\x02" * 20, b"\x03" * 20])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import mmap
+import multiprocessing
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from config import SHM_FRAMES, SHM_CLIENT_BYTES
+from frame_ring import FrameRing
+from presence import PresenceBus
+from sharding import SharedClient, SharedFrameWriter, ShardedServer, ShardUDPServer
+
+
+# Процесс приёма без сокетов: сообщения веб-процессу копятся в списке,
+# как в отставшем pipe
+class FakeShard:
+    shard = 0
+
+    def __init__(self, store):
+        self.store = store
+        self.messages = []
+
+    def send_to_web(self, message):
+        self.messages.append(message)
+
+    def post_frame(self, slot, message):
+        self.messages.append(message)
+
+
+def make_web(store):
+    web = ShardedServer.__new__(ShardedServer)
+    web.store = store
+    web._view = memoryview(store)
+    web.overwritten = 0
+    web.presence = PresenceBus()
+    web.clients_lock = threading.Lock()
+    client = SharedClient("127.0.0.1", 1, FrameRing())
+    web._slots = {(0, 0): client}
+    return web, client
+
+
+class SharedMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.store = mmap.mmap(-1, SHM_CLIENT_BYTES)
+        self.shard = FakeShard(self.store)
+        self.writer = SharedFrameWriter(self.shard, 0, 0, SHM_CLIENT_BYTES)
+        self.web, self.client = make_web(self.store)
+
+    def frame(self, i):
+        return bytes([i % 256]) * self.writer.max_frame
+
+    def test_frames_read_in_time(self):
+        for i in range(3 * SHM_FRAMES):
+            self.writer.append(self.frame(i))
+            self.web._dispatch(self.shard.messages.pop())
+            self.assertEqual(bytes(self.client.frames.latest().data), self.frame(i))
+        self.assertEqual(self.web.overwritten, 0)
+
+    def test_lagging_web_drops_overwritten_frames(self):
+        count = 3 * SHM_FRAMES
+        for i in range(count):
+            self.writer.append(self.frame(i))
+        delivered = []
+        for message in self.shard.messages:
+            before = self.client.frames.last_id
+            self.web._dispatch(message)
+            if self.client.frames.last_id != before:
+                delivered.append(bytes(self.client.frames.latest().data))
+        # Целыми доходят только кадры, которые ещё не затёрты
+        self.assertGreater(self.web.overwritten, 0)
+        self.assertEqual(len(delivered) + self.web.overwritten, count)
+        self.assertEqual(delivered, [self.frame(i) for i in range(count - len(delivered), count)])
+
+    def test_reused_slot_keeps_position(self):
+        for i in range(2):
+            self.writer.append(self.frame(i))
+        stale = self.shard.messages[0]
+        # Участок отдали новому клиенту, а сообщение прежнего ещё в pipe
+        writer = SharedFrameWriter(self.shard, 0, 0, SHM_CLIENT_BYTES)
+        for i in range(SHM_FRAMES + 1):
+            writer.append(b"\xff" * writer.max_frame)
+        self.web._dispatch(stale)
+        self.assertEqual(self.web.overwritten, 1)
+
+
+class ShardHandoffTest(unittest.TestCase):
+    def test_frame_notices_coalesce_per_slot(self):
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        server = ShardUDPServer(("127.0.0.1", 0), 0, mmap.mmap(-1, SHM_CLIENT_BYTES), writer)
+        # Веб ещё не читает: сообщения о кадрах одного участка заменяют друг друга
+        server.send_to_web(("connect", 0, 1, ("127.0.0.1", 1)))
+        for position in range(5):
+            server.post_frame(1, ("frame", 0, 1, position))
+        server.post_frame(2, ("frame", 0, 2, 0))
+        server.send_to_web(("disconnect", 0, 2))
+        sender = threading.Thread(target=server._send_loop, daemon=True)
+        sender.start()
+        try:
+            received = [reader.recv() for _ in range(3)]
+            self.assertFalse(reader.poll(0.1))
+        finally:
+            server.shutdown()
+            sender.join(2)
+            server.server_close()
+        self.assertEqual(received, [("connect", 0, 1, ("127.0.0.1", 1)), ("disconnect", 0, 2),
+                                    ("frame", 0, 1, 4)])
+        self.assertEqual(server.notices_coalesced, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+# Команды клиентам с подтверждением. Сервер шлёт на CLIENT_RECEIVE_PORT
+# клиента "cmd <id> <команда>", клиент отвечает на адрес отправителя
+# "ack <id> <статус>" (ok - выполнена, unknown - не знает такую команду).
+# Повтор с тем же id клиент не выполняет второй раз, только подтверждает.
+
+
+class _AckProtocol(asyncio.DatagramProtocol):
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def datagram_received(self, data, addr):
+        self.dispatcher.ack_received(data, addr)
+
+    def error_received(self, exc):
+        logging.warning(f"Ошибка сокета команд: {exc}")
+
+
+# Результат команды у одного клиента
+class _Delivery:
+    def __init__(self, ip):
+        self.ip = ip
+        self.status = "pending"  # pending, ok, unknown, error, timeout
+        self.attempts = 0
+        self.sent_at = None
+        self.rtt_ms = None
+        self.acked = None  # Future, выставляется при подтверждении
+
+    def as_dict(self):
+        return {"status": self.status, "attempts": self.attempts, "rtt_ms": self.rtt_ms}
+
+
+# Одна команда, отправленная одному или многим клиентам
+class CommandRecord:
+    def __init__(self, command_id, command, ips):
+        self.id = command_id
+        self.command = command
+        self.created = time.time()
+        self.deliveries = {ip: _Delivery(ip) for ip in ips}
+        self.done = asyncio.Event()
+
+    def summary(self):
+        counts = {}
+        for delivery in self.deliveries.values():
+            counts[delivery.status] = counts.get(delivery.status, 0) + 1
+        if not self.done.is_set():
+            status = "pending"
+        elif counts.get("ok", 0) == len(self.deliveries):
+            status = "success"
+        elif counts.get("ok", 0):
+            status = "partial"
+        else:
+            status = "error"
+        return {
+            "id": self.id,
+            "command": self.command,
+            "status": status,
+            "counts": counts,
+            "results": {ip: d.as_dict() for ip, d in self.deliveries.items()},
+        }
+
+
+# Рассылка команд из цикла событий веба. Один постоянный UDP-сокет на все
+# команды (через него же приходят подтверждения) и очередь отправки: задача
+# отправки за одно пробуждение выгребает из очереди всё накопленное (до
+# batch датаграмм), так что рассылка на сотни клиентов - один проход без
+# ожидания. Каждая доставка ждёт подтверждения timeout секунд и
+# повторяется до retries раз.
+class CommandDispatcher:
+    def __init__(self, port, timeout=0.5, retries=3, batch=256, history=100):
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.batch = batch
+        self.history = history
+        self._next_id = 1
+        self._records = OrderedDict()  # {id: CommandRecord}, последние history команд
+        self._pending = {}  # {(ip, id): _Delivery}
+        self._tasks = set()  # Незавершённые рассылки, чтобы задачи не собрал сборщик мусора
+        self._queue = None
+        self._transport = None
+        self._started = None
+        self._sender = None
+
+    async def _start(self):
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _AckProtocol(self), local_addr=("0.0.0.0", 0))
+        self._sender = loop.create_task(self._send_loop())
+        logging.info("Рассылка команд запущена.")
+
+    async def _ensure_started(self):
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        started = self._started
+        try:
+            await asyncio.shield(started)
+        except Exception:
+            # Запуск не удался (например, сокет) - следующая команда попробует снова
+            if self._started is started:
+                self._started = None
+            raise
+
+    # Создаёт команду и начинает доставку; ждать результат - await record.done.wait()
+    async def submit(self, ips, command):
+        await self._ensure_started()
+        record = CommandRecord(self._next_id, command, ips)
+        self._next_id += 1
+        self._records[record.id] = record
+        while len(self._records) > self.history:
+            self._records.popitem(last=False)
+        tasks = [self._deliver(record, delivery) for delivery in record.deliveries.values()]
+        task = asyncio.ensure_future(self._finish(record, tasks))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return record
+
+    def get(self, command_id):
+        return self._records.get(command_id)
+
+    async def _finish(self, record, tasks):
+        await asyncio.gather(*tasks)
+        record.done.set()
+        counts = record.summary()["counts"]
+        logging.info(f"Команда {record.id} \"{record.command}\": {counts}")
+
+    async def _deliver(self, record, delivery):
+        loop = asyncio.get_running_loop()
+        key = (delivery.ip, record.id)
+        self._pending[key] = delivery
+        try:
+            while delivery.attempts <= self.retries:
+                delivery.acked = loop.create_future()
+                delivery.attempts += 1
+                delivery.sent_at = time.monotonic()
+                self._queue.put_nowait((delivery.ip, f"cmd {record.id} {record.command}".encode()))
+                try:
+                    delivery.status = await asyncio.wait_for(delivery.acked, self.timeout)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+            delivery.status = "timeout"
+        finally:
+            self._pending.pop(key, None)
+
+    async def _send_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            for ip, message in batch:
+                try:
+                    self._transport.sendto(message, (ip, self.port))
+                except OSError as e:
+                    logging.error(f"Ошибка отправки команды клиенту {ip}: {e}")
+            # Даём подтверждениям и новым командам пройти между пачками
+            await asyncio.sleep(0)
+
+    # "ack <id> <статус>"
+    def ack_received(self, data, addr):
+        try:
+            kind, command_id, status = data.decode().split(maxsplit=2)
+            if kind != "ack":
+                raise ValueError
+            delivery = self._pending.get((addr[0], int(command_id)))
+        except ValueError:
+            logging.warning(f"Неправильное подтверждение команды от {addr}: {data[:64]!r}")
+            return
+        if delivery is None or delivery.acked is None or delivery.acked.done():
+            return  # Повтор подтверждения или поздний ответ
+        delivery.rtt_ms = round((time.monotonic() - delivery.sent_at) * 1000, 2)
+        delivery.acked.set_result(status.strip())
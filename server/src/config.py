@@ -1,6 +1,83 @@
 WHITELIST = {}
 ALLOWED_IPS = {'127.0.0.1'}
 TIMEOUT = 5
+IDLE_TIMEOUT = 30  # Таймаут для клиентов без движения в кадре (шлют редкий пульс)
 FPS = 31
-MAX_BUFFER_SIZE = 1000
-CLIENT_RECEIVE_PORT = 50006
\ No newline at end of file
+MAX_BUFFER_SIZE = 1000  # Максимум пакетов в одном кадре
+CLIENT_RECEIVE_PORT = 50006
+
+# Режим приёма UDP:
+#   "threaded" - старый ThreadedUDPServer, поток на каждую датаграмму
+#   "batch"    - несколько долгоживущих потоков вычитывают сокет пачками
+#   "asyncio"  - DatagramProtocol в одном цикле событий с uvicorn
+#   "multiprocess" - INGEST_PROCESSES процессов batch на одном порту
+#                (SO_REUSEPORT, только Linux), кадры отдаются вебу через
+#                общую память, клиенты делятся между процессами ядром
+INGEST_MODE = "batch"
+INGEST_WORKERS = 1  # Потоков приёма в режиме batch (и в каждом процессе)
+INGEST_PROCESSES = 2  # Процессов приёма в режиме multiprocess
+SHM_CLIENTS = 64  # Сколько клиентов принимает один процесс
+SHM_CLIENT_BYTES = 4*1024*1024  # Общая память под кадры одного клиента
+SHM_FRAMES = 10  # Сколько кадров наибольшего размера помещается в участке клиента
+# Веб копирует каждый кадр из общей памяти один раз (десятки КБ JPEG -
+# микросекунды на memcpy) и раздаёт зрителям копию. Без копии зритель держал
+# бы memoryview на участок, который процесс приёма перезапишет по кругу, а
+# проверка SHM_HEAD ловит порчу только в момент чтения, не во время отправки.
+SHARD_STATS_INTERVAL = 1  # Как часто (сек) процессы приёма шлют вебу счётчики для /metrics
+INGEST_BATCH = 64  # Сколько датаграмм вычитываем за одно пробуждение
+UDP_RCVBUF = 4*1024*1024
+
+MTU_SIZE = 1400  # Размер полезной нагрузки пакета, как MTU_SIZE у клиента
+REASSEMBLY_SLOTS = 4  # Сколько кадров одного клиента собираем одновременно
+SPARE_BUFFERS = 4  # Запасные буферы кадров клиента: последний кадр держат зрители и запись
+
+# Запрос потерянных пакетов у клиента (nack) по каналу команд
+NACK_ENABLED = True
+NACK_DELAY = 0.01  # Сколько секунд тишины по кадру считаем потерей пакетов
+NACK_RETRY = 0.03  # Пауза перед повторным запросом того же кадра
+NACK_MAX_ROUNDS = 2  # Сколько раз запрашиваем один кадр
+FRAME_DEADLINE = 0.25  # Кадр старше этого (от первого пакета) уже не показать
+
+# Как часто (сек) сообщаем клиентам потери и полезный поток, 0 - не сообщаем
+STATS_INTERVAL = 1
+
+LONG_POLL_TIMEOUT = 25  # Сколько секунд /screenshot?after=<id> ждёт новый кадр
+
+# Команды клиентам через /command: ждём подтверждение столько секунд и
+# повторяем столько раз, отправляем пачками до COMMAND_BATCH датаграмм
+COMMAND_TIMEOUT = 0.5
+COMMAND_RETRIES = 3
+COMMAND_BATCH = 256
+COMMAND_HISTORY = 100  # Сколько последних команд можно запросить через /command/{id}
+
+# Поток событий о клиентах /stream
+PRESENCE_HISTORY = 1024  # Сколько последних событий помним для переподключения с Last-Event-ID
+PRESENCE_KEEPALIVE = 25  # Раз в столько секунд без событий шлём комментарий-пинг
+
+# Дельты из плиток: холст клиента собирается в отдельном пуле потоков и
+# кодируется с качеством повыше, чтобы не было заметно второго сжатия
+CANVAS_WORKERS = 2
+CANVAS_JPEG_QUALITY = 90
+KEYFRAME_RETRY = 0.5  # Не чаще раза в столько секунд просим опорный кадр
+
+IMAGE_WORKERS = 2  # Потоков для декодирования/масштабирования/кодирования JPEG
+
+# Мозаика /mosaic из всех клиентов
+MOSAIC_FPS = 5
+MOSAIC_TILE_WIDTH = 320
+MOSAIC_TILE_HEIGHT = 240
+MOSAIC_JPEG_QUALITY = 70
+
+# Уменьшенные копии кадров (?w=&q= у /screenshot и /video)
+RENDITION_QUALITY = 70
+RENDITION_CACHE_BYTES = 32*1024*1024
+
+WS_MAX_SUBSCRIPTIONS = 64  # Сколько клиентов можно смотреть через одно соединение /ws/video
+
+# Запись кадров на диск (server/src/recorder.py) и просмотр через /recordings
+RECORDING_ENABLED = True
+RECORDINGS_DIR = "recordings"
+RECORDING_SEGMENT = 60  # Секунд в одном файле записи
+RECORDING_QUOTA = 10*1024*1024*1024  # Сколько байт записей хранить, старые удаляются
+RECORDING_QUEUE = 256  # Кадров в очереди на запись; если диск не успевает, кадры пропускаются
+RECORDING_FLUSH = 1.0  # Как часто (сек) сбрасываем буферы на диск
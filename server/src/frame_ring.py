@@ -0,0 +1,57 @@
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from waiters import Waiters
+
+
+# Собранный кадр. Неизменяемый, поэтому одним объектом пользуются все зрители
+class Frame(NamedTuple):
+    id: int
+    data: memoryview
+    timestamp: float
+    meta: Optional[tuple] = None  # protocol.FrameMeta, если клиент прислал метаданные
+
+
+# Последний кадр клиента. Запись O(1) из потока приёма, у каждого читателя
+# свой курсор - id последнего прочитанного кадра, кадры не копируются.
+# Читатель всегда берёт самый свежий кадр, пропуская промежуточные, поэтому
+# старые кадры не хранятся. Читатели в asyncio ждут новый кадр через future,
+# а не опросом.
+class FrameRing:
+    def __init__(self):
+        self.last_id = 0  # id последнего записанного кадра, 0 - кадров не было
+        self.latest_frame = None
+        self.closed = False
+        self._lock = threading.Lock()
+        self._waiters = Waiters(self._lock)
+        self.listener = None  # Вызывается с каждым новым кадром (запись на диск)
+
+    def append(self, data, meta=None):
+        with self._lock:
+            frame = Frame(self.last_id + 1, data, time.time(), meta)
+            self.last_id = frame.id
+            self.latest_frame = frame
+            waiters = self._waiters.take()
+        Waiters.wake(waiters)
+        if self.listener is not None:
+            self.listener(frame.data, frame.timestamp, meta)
+        return frame
+
+    # Ссылка на последний кадр меняется одним присваиванием, читаем без блокировки
+    def latest(self):
+        return self.latest_frame
+
+    # Ждём появления кадра новее after (или закрытия кольца)
+    async def wait(self, after, timeout=None):
+        with self._lock:
+            if self.last_id > after or self.closed:
+                return
+            fut = self._waiters.add()
+        await self._waiters.wait(fut, timeout)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            waiters = self._waiters.take()
+        Waiters.wake(waiters)
@@ -0,0 +1,82 @@
+import struct
+import time
+
+import cv2
+import numpy as np
+
+# Маркеры SOF, в которых лежат размеры JPEG (кроме DHT/JPG/DAC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Уменьшенное декодирование: libjpeg сразу отдаёт 1/2, 1/4 или 1/8 размера
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                  (4, cv2.IMREAD_REDUCED_COLOR_4),
+                  (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+# Размеры (ширина, высота) JPEG по заголовку без декодирования
+def jpeg_size(data):
+    view = memoryview(data)
+    pos = 2
+    while pos + 9 <= len(view):
+        if view[pos] != 0xFF:
+            return None
+        marker = view[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length, = struct.unpack_from('!H', view, pos + 2)
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack_from('!HH', view, pos + 5)
+            return width, height
+        pos += 2 + length
+    return None
+
+
+# Размер, вписанный в max_width x max_height с сохранением пропорций
+def fit_size(width, height, max_width, max_height=None):
+    scale = max_width / width
+    if max_height:
+        scale = min(scale, max_height / height)
+    scale = min(scale, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+# Декодирование с уменьшением до заданного размера. Если кадр намного больше,
+# декодируем сразу в 1/2..1/8 - это в разы дешевле полного декодирования.
+def decode_scaled(data, max_width, max_height=None):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    size = jpeg_size(data)
+    flags = cv2.IMREAD_COLOR
+    if size:
+        target = fit_size(size[0], size[1], max_width, max_height)
+        for factor, reduced in _REDUCED_FLAGS:
+            if size[0] // factor >= target[0] and size[1] // factor >= target[1]:
+                flags = reduced
+                break
+    image = cv2.imdecode(buf, flags)
+    if image is None:
+        return None
+    width, height = fit_size(image.shape[1], image.shape[0], max_width, max_height)
+    if (width, height) != (image.shape[1], image.shape[0]):
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def encode_jpeg(image, quality):
+    success, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not success:
+        return None
+    return buffer.tobytes()
+
+
+# Надпись "ID ЧЧ:ММ:СС" как у клиента, который рисует её сам (шрифт 0.5 при
+# исходной ширине кадра). scale - во сколько раз картинка меньше исходника.
+def draw_overlay(image, meta, scale=1.0):
+    text = f"{meta.label} {time.strftime('%H:%M:%S', time.localtime(meta.timestamp))}"
+    font_scale = max(0.3, 0.5 * scale)
+    thickness = 1
+    (text_width, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+    x = (image.shape[1] - text_width) // 16
+    y = max(12, round(30 * scale))
+    cv2.putText(image, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                (255, 255, 255), thickness, cv2.LINE_AA)
+    return image
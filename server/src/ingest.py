@@ -0,0 +1,47 @@
+import asyncio
+import logging
+import select
+
+# Размер буфера под одну датаграмму (максимум для UDP)
+_DATAGRAM_SIZE = 65536
+
+
+# Долгоживущий цикл приёма: один раз ждём готовности сокета и вычитываем
+# до batch датаграмм подряд без блокировок и без новых потоков.
+# В Python нет recvmmsg, поэтому пачка собирается неблокирующими
+# recvfrom_into в заранее выделенный буфер - аллокаций на пакет нет.
+def drain_socket(sock, handle, batch, stop_event):
+    buf = bytearray(_DATAGRAM_SIZE)
+    view = memoryview(buf)
+    while not stop_event.is_set():
+        ready, _, _ = select.select([sock], [], [], 0.5)
+        if not ready:
+            continue
+        for _ in range(batch):
+            try:
+                size, addr = sock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                if stop_event.is_set():
+                    return
+                logging.error(f"Ошибка чтения сокета: {e}")
+                break
+            # Обработчик обязан скопировать данные до следующего чтения
+            handle(view[:size], addr)
+
+
+# Приём через asyncio: датаграммы разбираются прямо в цикле событий uvicorn
+class DatagramIngest(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server.handle_datagram(data, addr)
+
+    def error_received(self, exc):
+        logging.warning(f"Ошибка приёма UDP: {exc}")
@@ -0,0 +1,364 @@
+import bisect
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Сбор показателей. Счётчики на пути приёма - обычные поля объектов, которые
+# и так меняются под блокировкой клиента (сборщик, Client), без общих
+# счётчиков и блокировок. Складываются и пересчитываются только при запросе
+# /metrics или /clients/{id}/stats.
+
+# Границы корзин (сек) для времени сборки кадра: от первого пакета до последнего
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+# Гистограмма с заранее выделенными корзинами: observe - один bisect и
+# два сложения, накопительные суммы считаются при выводе
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Последняя - больше всех границ
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    # Приблизительный квантиль - верхняя граница корзины, в которую он попал
+    def quantile(self, q):
+        total = self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# Зритель одного клиента (/video, /ws/video и т.д.). FPS - по скользящему
+# среднему интервала между отданными кадрами, чтобы было видно текущие рывки
+class Viewer:
+    def __init__(self, client_id, kind):
+        self.client_id = client_id
+        self.kind = kind
+        self.started = time.monotonic()
+        self.frames = 0
+        self.bytes = 0
+        self._last = None
+        self._interval = None
+
+    def delivered(self, size):
+        now = time.monotonic()
+        if self._last is not None:
+            interval = now - self._last
+            self._interval = interval if self._interval is None else 0.9 * self._interval + 0.1 * interval
+        self._last = now
+        self.frames += 1
+        self.bytes += size
+
+    @property
+    def fps(self):
+        if self._interval is None:
+            return 0.0
+        # Если кадров давно не было, FPS падает, не дожидаясь следующего
+        return 1 / max(self._interval, time.monotonic() - self._last, 1e-3)
+
+
+# Все текущие зрители и кадры, отданные уже ушедшими: {(клиент, вид): кадры}.
+# Меняются только из цикла событий веба
+viewers = set()
+finished_frames = {}
+
+
+def viewer_finished(viewer):
+    viewers.discard(viewer)
+    key = (viewer.client_id, viewer.kind)
+    finished_frames[key] = finished_frames.get(key, 0) + viewer.frames
+
+
+# Отдаёт кадры как есть, считая каждый, который зритель забрал.
+# delivered=False - только учёт зрителя, кадры он засчитывает сам в момент
+# отправки (у /ws/video часть кадров заменяется более новыми до отправки)
+async def counted(frames, viewer, delivered=True):
+    viewers.add(viewer)
+    try:
+        async for frame in frames:
+            if delivered:
+                viewer.delivered(len(frame.data))
+            yield frame
+    finally:
+        viewer_finished(viewer)
+
+
+# Счётчик, который увеличивают несколько потоков без общей блокировки: у
+# каждого потока своя ячейка, сумма считается при чтении. Ячейки по номеру
+# потока, номера завершившихся потоков переиспользуются новыми.
+class ThreadCounter:
+    def __init__(self):
+        self._cells = {}
+
+    def add(self, n=1):
+        ident = threading.get_ident()
+        self._cells[ident] = self._cells.get(ident, 0) + n
+
+    @property
+    def value(self):
+        return sum(list(self._cells.values()))
+
+
+# Пул потоков, который сам считает поставленные и завершённые задачи для
+# /metrics (внутренняя очередь ThreadPoolExecutor - не публичное API)
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.submitted = 0
+        self.finished = 0
+        self._count_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        with self._count_lock:
+            self.submitted += 1
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._count_lock:
+            self.finished += 1
+
+
+# Очередь и потери сокета приёма из /proc/net/udp (только Linux): байт в
+# очереди сокета и датаграмм, отброшенных ядром из-за полного буфера
+def udp_socket_stats(sock):
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        with open("/proc/net/udp") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if fields[9] == inode:
+                    return int(fields[4].split(':')[1], 16), int(fields[-1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def client_id(client):
+    return f"{client.ip}:{client.port}"
+
+
+# Счётчики приёма клиента одним словарём: так их можно передать по pipe из
+# процесса приёма в режиме multiprocess (sharding.forward_stats)
+def ingest_snapshot(client):
+    r = client.reassembler
+    with client.lock:
+        snapshot = {
+            "packets": r.packets,
+            "bytes_in": r.bytes_in,
+            "frames_completed": r.completed,
+            "frames_evicted": r.evicted,
+            "packets_stale": r.stale,
+            "packets_duplicate": r.duplicates,
+            "packets_malformed": r.malformed,
+            "packets_nacked": r.nacked,
+            "packets_retransmitted": r.retransmitted,
+            "packets_fec_recovered": r.fec_packets,
+            "reassembling": len(r.pending()),
+            "latency_counts": list(r.latency.counts),
+            "latency_sum": r.latency.sum,
+        }
+    snapshot["lock_waits"] = client.lock_waits
+    snapshot["lock_wait_seconds"] = client.lock_wait_seconds
+    canvas = client.canvas
+    if canvas is not None:
+        snapshot["canvas_queue"] = canvas.queue_depth
+        snapshot["canvas_dropped"] = canvas.dropped
+    return snapshot
+
+
+# Счётчики приёма: свои, если клиент собирается в этом процессе, иначе
+# последние присланные процессом приёма (или None, если ещё не было)
+def _ingest(client):
+    if getattr(client, "reassembler", None) is not None:
+        return ingest_snapshot(client)
+    return getattr(client, "ingest", None)
+
+
+def _latency(snapshot):
+    latency = Histogram()
+    latency.counts, latency.sum = snapshot["latency_counts"], snapshot["latency_sum"]
+    return latency
+
+
+# Общие счётчики процесса приёма (тоже словарь для передачи по pipe)
+def server_snapshot(server):
+    snapshot = {"datagram_errors": server.datagram_errors.value, "rejected": server.rejected.value}
+    recorder = getattr(server, "recorder", None)
+    if recorder is not None:
+        snapshot.update(recorder_queue=recorder.queue_depth, recorder_frames=recorder.recorded,
+                        recorder_dropped=recorder.dropped)
+    coalesced = getattr(server, "notices_coalesced", None)
+    if coalesced is not None:
+        snapshot["shm_notices_coalesced"] = coalesced
+    sock = getattr(server, "socket", None)
+    udp = udp_socket_stats(sock) if sock is not None else None
+    if udp is not None:
+        snapshot.update(udp_queue=udp[0], udp_drops=udp[1])
+    return snapshot
+
+
+# Показатели одного клиента (json)
+def client_stats(client):
+    result = {
+        "id": client_id(client),
+        "state": client.state,
+        "last_activity": client.last_activity,
+        "last_frame_id": client.frames.last_id,
+    }
+    snapshot = _ingest(client)
+    if snapshot is not None:
+        latency = _latency(snapshot)
+        result.update((k, v) for k, v in snapshot.items() if not k.startswith("latency_"))
+        result["reassembly_p50"] = latency.quantile(0.5)
+        result["reassembly_p99"] = latency.quantile(0.99)
+    cid = result["id"]
+    result["viewers"] = [{"kind": v.kind, "fps": round(v.fps, 2), "frames": v.frames, "bytes": v.bytes}
+                         for v in list(viewers) if v.client_id == cid]
+    return result
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+# Текст в формате Prometheus: {имя: (тип, описание, [(метки, значение)])}
+class _Exposition:
+    def __init__(self):
+        self._metrics = {}
+
+    def add(self, name, metric_type, help_text, value, **labels):
+        self._metrics.setdefault(name, (metric_type, help_text, []))[2].append((labels, value))
+
+    def histogram(self, name, help_text, histogram, **labels):
+        samples = self._metrics.setdefault(name, ("histogram", help_text, []))[2]
+        cumulative = 0
+        for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            samples.append(({**labels, "le": le}, cumulative, "_bucket"))
+        samples.append((labels, histogram.sum, "_sum"))
+        samples.append((labels, cumulative, "_count"))
+
+    def render(self):
+        lines = []
+        for name, (metric_type, help_text, samples) in self._metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample in samples:
+                labels, value = sample[0], sample[1]
+                suffix = sample[2] if len(sample) > 2 else ""
+                lines.append(f"{name}{suffix}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# В режиме multiprocess общие счётчики - сумма по процессам приёма
+# (server.shard_stats), счётчики клиентов приходят вместе с ними
+def render_prometheus(server, executors=None):
+    out = _Exposition()
+    clients = list(server.clients.values())
+    counters = server_snapshot(server)
+    for snapshot in list(getattr(server, "shard_stats", {}).values()):
+        for key, value in snapshot.items():
+            counters[key] = counters.get(key, 0) + value
+    out.add("ff_clients", "gauge", "Connected clients", len(clients))
+    out.add("ff_datagram_errors_total", "counter", "Datagrams that failed to parse", counters["datagram_errors"])
+    out.add("ff_datagrams_rejected_total", "counter", "Datagrams from addresses not in WHITELIST",
+            counters["rejected"])
+    overwritten = getattr(server, "overwritten", None)
+    if overwritten is not None:
+        out.add("ff_shm_frames_overwritten_total", "counter",
+                "Frames overwritten in shared memory before the web process read them", overwritten)
+    if "shm_notices_coalesced" in counters:
+        out.add("ff_shm_notices_coalesced_total", "counter",
+                "Frame notices replaced by a newer frame before the web process read them",
+                counters["shm_notices_coalesced"])
+
+    for client in clients:
+        cid = client_id(client)
+        out.add("ff_client_active", "gauge", "1 if the client reports motion, 0 if idle",
+                int(client.state == "active"), client=cid)
+        s = _ingest(client)
+        if s is None:
+            continue
+        out.add("ff_packets_received_total", "counter", "Packets received", s["packets"], client=cid)
+        out.add("ff_bytes_received_total", "counter", "Payload bytes received", s["bytes_in"], client=cid)
+        out.add("ff_frames_completed_total", "counter", "Frames reassembled", s["frames_completed"], client=cid)
+        out.add("ff_frames_evicted_total", "counter", "Incomplete frames dropped for newer ones",
+                s["frames_evicted"], client=cid)
+        for reason in ("stale", "duplicate", "malformed"):
+            out.add("ff_packets_dropped_total", "counter", "Packets discarded by the reassembler",
+                    s[f"packets_{reason}"], client=cid, reason=reason)
+        out.add("ff_packets_nacked_total", "counter", "Packets requested again", s["packets_nacked"], client=cid)
+        out.add("ff_packets_retransmitted_total", "counter", "Retransmitted packets received",
+                s["packets_retransmitted"], client=cid)
+        out.add("ff_packets_fec_recovered_total", "counter", "Packets restored from parity",
+                s["packets_fec_recovered"], client=cid)
+        out.add("ff_frames_reassembling", "gauge", "Frames being reassembled", s["reassembling"], client=cid)
+        out.histogram("ff_reassembly_seconds", "Time from first to last packet of a frame",
+                      _latency(s), client=cid)
+        out.add("ff_client_lock_waits_total", "counter", "Contended acquisitions of the client lock",
+                s["lock_waits"], client=cid)
+        out.add("ff_client_lock_wait_seconds_total", "counter", "Time spent waiting for the client lock",
+                s["lock_wait_seconds"], client=cid)
+        if "canvas_queue" in s:
+            out.add("ff_canvas_queue", "gauge", "Delta frames waiting for the canvas",
+                    s["canvas_queue"], client=cid)
+            out.add("ff_canvas_dropped_total", "counter", "Deltas dropped without a keyframe",
+                    s["canvas_dropped"], client=cid)
+
+    # Зрители складываются по клиенту и виду потока: {(клиент, вид): [зрители, кадры, fps]}.
+    # Кадры - включая отданные ушедшим зрителям, чтобы счётчик не убывал
+    online = {client_id(client) for client in clients}
+    for key in [key for key in finished_frames if key[0] not in online]:
+        del finished_frames[key]  # Клиент отключился - его ряды пропадают целиком
+    per_client = {key: [0, frames, 0.0] for key, frames in finished_frames.items()}
+    for viewer in list(viewers):
+        totals = per_client.setdefault((viewer.client_id, viewer.kind), [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += viewer.frames
+        totals[2] += viewer.fps
+    for (cid, kind), (count, frames, fps) in per_client.items():
+        out.add("ff_viewers", "gauge", "Connected viewers", count, client=cid, kind=kind)
+        out.add("ff_viewer_frames_total", "counter", "Frames delivered to viewers",
+                frames, client=cid, kind=kind)
+        out.add("ff_viewer_fps", "gauge", "Delivered frames per second, summed over viewers",
+                round(fps, 2), client=cid, kind=kind)
+
+    for name, executor in (executors or {}).items():
+        submitted, finished = executor.submitted, executor.finished
+        out.add("ff_executor_pending", "gauge", "Tasks queued or running in a thread pool",
+                max(submitted - finished, 0), pool=name)
+        out.add("ff_executor_tasks_total", "counter", "Tasks finished by a thread pool", finished, pool=name)
+    if "recorder_queue" in counters:
+        out.add("ff_recorder_queue", "gauge", "Frames waiting to be written", counters["recorder_queue"])
+        out.add("ff_recorder_frames_total", "counter", "Frames written to disk", counters["recorder_frames"])
+        out.add("ff_recorder_dropped_total", "counter", "Frames skipped because the disk fell behind",
+                counters["recorder_dropped"])
+    if "udp_queue" in counters:
+        out.add("ff_udp_rx_queue_bytes", "gauge", "Bytes waiting in the UDP receive buffer", counters["udp_queue"])
+        out.add("ff_udp_drops_total", "counter", "Datagrams dropped by the kernel (buffer full)",
+                counters["udp_drops"])
+    return out.render()
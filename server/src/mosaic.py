@@ -0,0 +1,98 @@
+import asyncio
+import math
+import logging
+
+import numpy as np
+
+from frame_ring import FrameRing
+from imaging import decode_scaled, encode_jpeg
+from streaming import latest_frames
+
+
+# Общая мозаика из последних кадров всех клиентов. Сетка собирается с
+# заданной частотой в отдельном потоке, кодируется один раз за такт и
+# через кольцо кадров раздаётся всем подписчикам. Перерисовываются только
+# плитки, у которых сменился кадр.
+class Mosaic:
+    def __init__(self, server, executor, fps, tile_width, tile_height, quality):
+        self.server = server
+        self.executor = executor
+        self.interval = 1 / fps
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.quality = quality
+        self.frames = FrameRing()
+        self.subscribers = 0  # Пока есть зрители, мозаика собирается
+        self._task = None
+
+        # Состояние сборки, меняется только в потоке executor
+        self._canvas = None
+        self._layout = ()  # Адреса клиентов по порядку плиток
+        self._drawn = {}  # {client_addr: кадр, нарисованный в плитке}
+
+    # Кадры мозаики для одного зрителя
+    async def stream(self):
+        self.subscribers += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        try:
+            async for frame in latest_frames(self.frames):
+                yield frame
+        finally:
+            self.subscribers -= 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        logging.info("Сборка мозаики запущена.")
+        try:
+            while self.subscribers > 0:
+                started = loop.time()
+                sources = [(addr, client.frames.latest()) for addr, client in self.server.clients.items()]
+                jpeg = await loop.run_in_executor(self.executor, self._compose, sources)
+                if jpeg is not None:
+                    self.frames.append(jpeg)
+                await asyncio.sleep(max(0, self.interval - (loop.time() - started)))
+        except Exception as e:
+            logging.error(f"Ошибка сборки мозаики: {e}")
+        finally:
+            # Сборка остановилась при живых зрителях (ошибка или отмена) - закрываем
+            # кольцо, иначе они ждут кадр вечно. Следующий зритель начнёт с нового
+            if self.subscribers > 0:
+                frames, self.frames = self.frames, FrameRing()
+                frames.close()
+            logging.info("Сборка мозаики остановлена.")
+
+    def _compose(self, sources):
+        layout = tuple(addr for addr, _ in sources)
+        changed = False
+        if layout != self._layout or self._canvas is None:
+            columns = max(1, math.ceil(math.sqrt(len(layout))))
+            rows = max(1, math.ceil(len(layout) / columns))
+            self._canvas = np.zeros((rows * self.tile_height, columns * self.tile_width, 3), dtype=np.uint8)
+            self._layout = layout
+            self._drawn = {}
+            changed = True
+
+        columns = self._canvas.shape[1] // self.tile_width
+        for index, (addr, frame) in enumerate(sources):
+            if frame is None or self._drawn.get(addr) is frame:
+                continue
+            image = decode_scaled(frame.data, self.tile_width, self.tile_height)
+            if image is None:
+                continue
+            y = (index // columns) * self.tile_height
+            x = (index % columns) * self.tile_width
+            tile = self._canvas[y:y + self.tile_height, x:x + self.tile_width]
+            # Кадр вписан в плитку по центру, поля заливаем чёрным
+            height, width = image.shape[:2]
+            top = (self.tile_height - height) // 2
+            left = (self.tile_width - width) // 2
+            tile[:] = 0
+            tile[top:top + height, left:left + width] = image
+            self._drawn[addr] = frame
+            changed = True
+
+        if not changed:
+            return None
+        return encode_jpeg(self._canvas, self.quality)
+
@@ -0,0 +1,104 @@
+import secrets
+import threading
+from collections import deque
+from typing import NamedTuple
+
+from waiters import Waiters
+
+
+# Событие о клиенте: join (подключился), leave (отключился), state (active/idle)
+class PresenceEvent(NamedTuple):
+    seq: int
+    kind: str
+    client_id: str  # "ip:port"
+    state: str
+
+
+# Общая шина присутствия клиентов для всех подписчиков /stream. События
+# публикуют приём (подключение, смена состояния) и удаление клиентов, у
+# каждого свой номер. Подписчик ждёт новое событие через future, без опроса,
+# и получает только изменения; отставший или переподключившийся с
+# Last-Event-ID дочитывает пропущенное из истории, а если история уже
+# ушла дальше - получает снимок списка целиком.
+class PresenceBus:
+    def __init__(self, history=1024):
+        self.epoch = secrets.token_hex(4)  # Номера событий после перезапуска сервера не совпадут
+        self.seq = 0
+        self._clients = {}  # {client_id: state} после события seq
+        self._history = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._waiters = Waiters(self._lock)
+
+    def publish(self, kind, client_id, state=""):
+        with self._lock:
+            if kind == "leave":
+                if self._clients.pop(client_id, None) is None:
+                    return
+            elif self._clients.get(client_id) == state:
+                return
+            else:
+                self._clients[client_id] = state
+            self.seq += 1
+            self._history.append(PresenceEvent(self.seq, kind, client_id, state))
+            waiters = self._waiters.take()
+        Waiters.wake(waiters)
+
+    # (номер последнего события, {client_id: state})
+    def snapshot(self):
+        with self._lock:
+            return self.seq, dict(self._clients)
+
+    # События после seq или None, если часть из них уже вытеснена из истории
+    def since(self, seq):
+        with self._lock:
+            if seq >= self.seq:
+                return []
+            if not self._history or self._history[0].seq > seq + 1:
+                return None
+            return [event for event in self._history if event.seq > seq]
+
+    # Ждём событие новее after. Таймаут - пинг keepalive, ждущий при этом
+    # снимается, иначе при тихом парке копилось бы по одному на пинг
+    async def wait(self, after, timeout=None):
+        with self._lock:
+            if self.seq > after:
+                return
+            fut = self._waiters.add()
+        await self._waiters.wait(fut, timeout)
+
+    def event_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    # Номер из Last-Event-ID этой же шины, иначе None
+    def parse_event_id(self, event_id):
+        if not event_id:
+            return None
+        epoch, _, seq = event_id.rpartition('-')
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        return int(seq)
+
+
+# Поток Server-Sent Events для одного подписчика:
+#   event: snapshot, data: "ip:port=state,..." или "empty" - весь список
+#   event: join / state, data: "ip:port=state"
+#   event: leave, data: "ip:port"
+# Пока событий нет, раз в keepalive секунд уходит комментарий, чтобы
+# прокси и браузер не закрыли соединение.
+async def sse_events(bus, last_event_id=None, keepalive=25):
+    cursor = bus.parse_event_id(last_event_id)
+    events = bus.since(cursor) if cursor is not None else None
+    while True:
+        if events is None:
+            cursor, clients = bus.snapshot()
+            data = ','.join(f"{c}={s}" for c, s in clients.items()) or "empty"
+            yield f"id: {bus.event_id(cursor)}\nevent: snapshot\ndata: {data}\n\n"
+        else:
+            for event in events:
+                data = event.client_id if event.kind == "leave" else f"{event.client_id}={event.state}"
+                yield f"id: {bus.event_id(event.seq)}\nevent: {event.kind}\ndata: {data}\n\n"
+                cursor = event.seq
+        await bus.wait(cursor, keepalive)
+        events = bus.since(cursor)
+        if events == []:
+            yield ": keepalive\n\n"
@@ -0,0 +1,63 @@
+import struct
+from typing import NamedTuple, Optional
+
+# Старый заголовок: 4 байта - номер кадра, 2 - номер пакета, 2 - всего пакетов
+LEGACY_HEADER = struct.Struct('!IHH')
+
+# Расширенный заголовок. Признак - старший бит в поле "всего пакетов".
+# После общих полей: версия, тип пакета, размер группы FEC, флаги и
+# полный размер кадра в байтах (нужен, чтобы восстановить последний пакет).
+EXT_HEADER = struct.Struct('!IHHBBBBI')
+EXT_FLAG = 0x8000
+VERSION = 1
+
+KIND_DATA = 0
+KIND_PARITY = 1  # XOR пакетов группы; номер пакета = номер группы
+
+FLAG_RETRANSMIT = 0x01  # Пакет отправлен повторно по nack
+FLAG_META = 0x02  # После заголовка идут метаданные кадра
+FLAG_IDLE = 0x04  # В кадре ничего не движется, клиент шлёт только редкий пульс
+FLAG_DELTA = 0x08  # Кадр - опорный или дельта из плиток (см. tile_canvas.py)
+
+# Метаданные кадра вместо надписи на картинке: время съёмки (unix, сек),
+# длина подписи и сама подпись в UTF-8 (ID кормушки). Одинаковы во всех
+# пакетах кадра, поэтому доходят с любым пакетом, который его завершил.
+META_HEADER = struct.Struct('!dB')
+
+
+class FrameMeta(NamedTuple):
+    timestamp: float
+    label: str
+
+
+class Packet(NamedTuple):
+    seq: int
+    num: int
+    total: int  # Число пакетов с данными
+    kind: int
+    fec_k: int  # Пакетов данных в группе FEC, 0 - без FEC
+    flags: int
+    frame_size: int  # 0 - неизвестен (старый заголовок)
+    payload: memoryview
+    meta: Optional[FrameMeta] = None
+
+
+# Разбор датаграммы любой версии. Полезная нагрузка - memoryview без копии
+def parse_packet(data):
+    seq, num, total = LEGACY_HEADER.unpack_from(data)
+    if not total & EXT_FLAG:
+        return Packet(seq, num, total, KIND_DATA, 0, 0, 0, memoryview(data)[LEGACY_HEADER.size:])
+
+    seq, num, total, version, kind, fec_k, flags, frame_size = EXT_HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"неизвестная версия заголовка {version}")
+    offset = EXT_HEADER.size
+    meta = None
+    if flags & FLAG_META:
+        timestamp, label_size = META_HEADER.unpack_from(data, offset)
+        offset += META_HEADER.size
+        label = bytes(data[offset:offset + label_size]).decode(errors='replace')
+        offset += label_size
+        meta = FrameMeta(timestamp, label)
+    return Packet(seq, num, total & ~EXT_FLAG, kind, fec_k, flags, frame_size,
+                  memoryview(data)[offset:], meta)
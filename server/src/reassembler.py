@@ -0,0 +1,308 @@
+import time
+from collections import deque
+
+from metrics import Histogram
+from protocol import KIND_PARITY, FLAG_RETRANSMIT
+
+SEQ_MOD = 2**32
+_SEQ_HALF = 2**31
+
+# Если номер кадра ушёл назад дальше этого, считаем что клиент перезапустился
+RESTART_GAP = 64
+
+
+# Свободен ли буфер отданного кадра: bytearray не даёт менять свой размер,
+# пока на него есть хоть один memoryview (последний кадр клиента, зритель, запись)
+def _buffer_free(buf):
+    try:
+        del buf[-1]
+    except BufferError:
+        return False
+    buf.append(0)  # Уменьшение и возврат размера без перевыделения памяти
+    return True
+
+
+# Знаковая разница a - b для 32-битного счётчика кадров с переполнением
+def seq_diff(a, b):
+    d = (a - b) % SEQ_MOD
+    return d - SEQ_MOD if d >= _SEQ_HALF else d
+
+
+# Один собираемый кадр: буфер под все пакеты и отметки о полученных
+class _Slot:
+    __slots__ = ('seq', 'total', 'count', 'size', 'buf', 'received', 'first_time',
+                 'fec_k', 'group_count', 'parity', 'recovered',
+                 'last_time', 'nack_rounds', 'last_nack', 'fec_waited', 'original')
+
+    def __init__(self, max_packets):
+        self.seq = None
+        self.total = 0
+        self.count = 0
+        self.size = 0
+        self.buf = None
+        self.received = bytearray(max_packets)
+        self.first_time = 0.0
+        self.fec_k = 0
+        self.group_count = []  # Сколько пакетов данных пришло в каждой группе FEC
+        self.parity = {}  # {номер группы: пакет чётности}
+        self.recovered = False
+        self.last_time = 0.0  # Когда пришёл последний пакет кадра
+        self.nack_rounds = 0
+        self.last_nack = 0.0
+        self.fec_waited = False  # Группы без одного пакета уже ждали чётность
+        self.original = 0  # Пакеты данных, дошедшие с первой попытки
+
+    def start(self, seq, total, mtu, fec_k=0, frame_size=0):
+        self.seq = seq
+        self.total = total
+        self.count = 0
+        # Без размера кадра в заголовке он уточнится, когда придёт последний пакет
+        self.size = frame_size or (total - 1) * mtu
+        if self.buf is None or len(self.buf) < total * mtu:
+            self.buf = bytearray(total * mtu)
+        self.received[:total] = bytes(total)
+        self.first_time = self.last_time = time.time()
+        self.nack_rounds = 0
+        self.last_nack = 0.0
+        self.fec_waited = False
+        self.original = 0
+        self.fec_k = fec_k
+        self.group_count = [0] * ((total + fec_k - 1) // fec_k) if fec_k else []
+        self.parity = {}
+        self.recovered = False
+
+    # Битовая карта недостающих пакетов (бит i байта i // 8 - пакет i) и их
+    # число. skip_fec - не включать группы FEC без ровно одного пакета: его
+    # восстановит чётность группы, которая ещё может прийти.
+    def missing_bitmap(self, skip_fec=False):
+        bitmap = bytearray((self.total + 7) // 8)
+        count = 0
+        for i in range(self.total):
+            if self.received[i]:
+                continue
+            if skip_fec and self.fec_k:
+                group = i // self.fec_k
+                size = min(self.fec_k, self.total - group * self.fec_k)
+                if self.group_count[group] == size - 1:
+                    continue
+            bitmap[i >> 3] |= 1 << (i & 7)
+            count += 1
+        return bytes(bitmap), count
+
+
+# Сборка кадров из пакетов с фиксированным числом одновременно собираемых
+# кадров. Пакет пишется сразу по смещению packet_num * mtu, готовый кадр
+# отдаётся как memoryview на буфер слота без склейки. Потерянный пакет
+# восстанавливается по пакету чётности своей группы, если клиент шлёт FEC.
+# Буфер отданного кадра встаёт в очередь spare_buffers последних и снова
+# идёт в слот, когда на кадр не осталось ссылок (обычно - его сменил более
+# новый кадр клиента), так что в установившемся режиме новые буферы не нужны.
+class FrameReassembler:
+    def __init__(self, mtu, slots, max_packets, spare_buffers=0):
+        self.mtu = mtu
+        self.max_packets = max_packets
+        self._free = [_Slot(max_packets) for _ in range(slots)]
+        self._active = {}  # {packet_seq: _Slot}
+        self._spare = deque(maxlen=spare_buffers)  # Буферы отданных кадров, старые слева
+        self.newest = None  # Номер последнего собранного кадра
+
+        # Счётчики для статистики
+        self.completed = 0
+        self.evicted = 0  # Недособранные кадры, вытесненные более новыми
+        self.stale = 0  # Пакеты уже неактуальных кадров
+        self.duplicates = 0
+        self.malformed = 0
+        self.fec_packets = 0  # Пакеты, восстановленные по чётности
+        self.fec_frames = 0  # Кадры, собранные только благодаря FEC
+        self.nacked = 0  # Пакеты, запрошенные повторно
+        self.retransmitted = 0  # Пришедшие повторы
+        self.packets = 0  # Все пришедшие пакеты
+        self.bytes_in = 0
+        self.completed_bytes = 0  # Полезный поток: байты собранных кадров
+        self.expected_packets = 0  # Пакеты данных в завершённых и вытесненных кадрах
+        self.original_packets = 0  # Из них дошедшие с первой попытки
+        self.latency = Histogram()  # От первого до последнего пакета кадра, сек
+
+    def add(self, packet):
+        seq, num, total = packet.seq, packet.num, packet.total
+        payload = packet.payload
+        size = len(payload)
+        self.packets += 1
+        self.bytes_in += size
+        if total == 0 or total > self.max_packets or size > self.mtu:
+            self.malformed += 1
+            return None
+        if packet.kind == KIND_PARITY:
+            if not packet.fec_k or num * packet.fec_k >= total or size != self.mtu:
+                self.malformed += 1
+                return None
+        elif num >= total or (num < total - 1 and size != self.mtu):
+            self.malformed += 1
+            return None
+
+        if self.newest is not None:
+            d = seq_diff(seq, self.newest)
+            if d < -RESTART_GAP:
+                self.reset()
+            elif d <= 0:
+                self.stale += 1
+                return None
+
+        slot = self._active.get(seq)
+        if slot is None:
+            slot = self._take_slot(seq)
+            if slot is None:
+                self.stale += 1
+                return None
+            if slot.buf is None:
+                slot.buf = self._reuse_buffer()
+            slot.start(seq, total, self.mtu, packet.fec_k, packet.frame_size)
+            self._active[seq] = slot
+        elif slot.total != total or slot.fec_k != packet.fec_k:
+            self.malformed += 1
+            return None
+
+        slot.last_time = time.time()
+        if packet.flags & FLAG_RETRANSMIT:
+            self.retransmitted += 1
+
+        if packet.kind == KIND_PARITY:
+            if num in slot.parity:
+                self.duplicates += 1
+                return None
+            slot.parity[num] = bytes(payload)
+            self._recover(slot, num)
+        else:
+            if slot.received[num]:
+                self.duplicates += 1
+                return None
+            self._put(slot, num, payload)
+            if not packet.flags & FLAG_RETRANSMIT:
+                slot.original += 1
+            if slot.fec_k:
+                self._recover(slot, num // slot.fec_k)
+
+        if slot.count < slot.total:
+            return None
+        return self._complete(slot)
+
+    def pending(self):
+        return list(self._active.values())
+
+    # Есть ли недособранные кадры. Читается без блокировки клиента, чтобы
+    # поток nack не трогал блокировки клиентов, которым нечего запрашивать.
+    @property
+    def has_pending(self):
+        return bool(self._active)
+
+    # Кадры, для которых пора запросить потерянные пакеты: поток пакетов кадра
+    # затих на delay, а до крайнего срока показа ещё есть время.
+    # Группы FEC без одного пакета в первый раз не запрашиваются - их
+    # восстановит чётность; если она так и не пришла за retry, следующий
+    # запрос включает и их.
+    # Возвращает [(номер кадра, битовая карта недостающих пакетов)].
+    def nack_candidates(self, now, delay, retry, deadline, max_rounds):
+        result = []
+        for slot in self._active.values():
+            if slot.nack_rounds >= max_rounds or now - slot.first_time > deadline:
+                continue
+            if now - slot.last_time < delay or now - slot.last_nack < retry:
+                continue
+            bitmap, count = slot.missing_bitmap(skip_fec=not slot.fec_waited)
+            slot.fec_waited = True
+            slot.last_nack = now
+            if not count:
+                continue  # Всё недостающее покрывает чётность
+            slot.nack_rounds += 1
+            self.nacked += count
+            result.append((slot.seq, bitmap))
+        return result
+
+    def reset(self):
+        for seq in list(self._active):
+            self._release(seq)
+        self.newest = None
+
+    def _put(self, slot, num, payload):
+        offset = num * self.mtu
+        size = len(payload)
+        slot.buf[offset:offset + size] = payload
+        slot.received[num] = 1
+        slot.count += 1
+        if num == slot.total - 1:
+            slot.size = offset + size
+        if slot.fec_k:
+            slot.group_count[num // slot.fec_k] += 1
+
+    # Если в группе не хватает ровно одного пакета и есть чётность,
+    # недостающий пакет - XOR чётности со всеми пришедшими пакетами группы
+    def _recover(self, slot, group):
+        parity = slot.parity.get(group)
+        if parity is None:
+            return
+        first = group * slot.fec_k
+        last = min(first + slot.fec_k, slot.total)
+        if slot.group_count[group] != last - first - 1:
+            return
+
+        acc = int.from_bytes(parity, 'big')
+        missing = None
+        for i in range(first, last):
+            if not slot.received[i]:
+                missing = i
+                continue
+            offset = i * self.mtu
+            length = min(self.mtu, slot.size - offset) if i == slot.total - 1 else self.mtu
+            # Короткий последний пакет дополнен нулями справа, как при расчёте чётности
+            acc ^= int.from_bytes(slot.buf[offset:offset + length], 'big') << (8 * (self.mtu - length))
+        chunk = acc.to_bytes(self.mtu, 'big')
+        if missing == slot.total - 1:
+            # Длина последнего пакета известна только из размера кадра
+            chunk = chunk[:slot.size - missing * self.mtu]
+        self._put(slot, missing, chunk)
+        slot.recovered = True
+        self.fec_packets += 1
+
+    # Самый старый отданный буфер, если его кадр уже никто не держит
+    def _reuse_buffer(self):
+        if self._spare and _buffer_free(self._spare[0]):
+            return self._spare.popleft()
+        return None
+
+    def _take_slot(self, seq):
+        if self._free:
+            return self._free.pop()
+        # Все слоты заняты - вытесняем самый старый кадр, если новый пакет не старее его
+        oldest = min(self._active, key=lambda s: seq_diff(s, seq))
+        if seq_diff(seq, oldest) < 0:
+            return None
+        self.evicted += 1
+        self._release(oldest)
+        return self._free.pop()
+
+    def _complete(self, slot):
+        seq = slot.seq
+        frame = memoryview(slot.buf)[:slot.size].toreadonly()
+        # Буфер уходит вместе с кадром, слот возьмёт освободившийся из запасных
+        if self._spare.maxlen:
+            self._spare.append(slot.buf)
+        slot.buf = None
+        self.completed += 1
+        self.completed_bytes += slot.size
+        self.latency.observe(slot.last_time - slot.first_time)
+        if slot.recovered:
+            self.fec_frames += 1
+        self.newest = seq
+        self._release(seq)
+        # Кадры старше собранного уже не нужны
+        for older in [s for s in self._active if seq_diff(s, seq) < 0]:
+            self.evicted += 1
+            self._release(older)
+        return frame
+
+    def _release(self, seq):
+        slot = self._active.pop(seq)
+        self.expected_packets += slot.total
+        self.original_packets += slot.original
+        slot.seq = None
+        self._free.append(slot)
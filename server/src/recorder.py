@@ -0,0 +1,287 @@
+import bisect
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+from frame_ring import Frame
+
+# Запись: у каждого клиента ("ip:port") своя папка, в ней сегменты по
+# времени. Сегмент - пара файлов: <начало в мс>[-<метка>].mjpg с JPEG подряд
+# и .idx с записями фиксированной длины (время, смещение, размер), по
+# которым кадр на нужный момент ищется двоичным поиском.
+INDEX_RECORD = struct.Struct('<dQI')
+DATA_SUFFIX = '.mjpg'
+INDEX_SUFFIX = '.idx'
+
+
+# Папка клиента "ip:port" - "ip_port": в Windows двоеточие в именах нельзя
+def _folder(source):
+    return source.replace(':', '_')
+
+
+def _source(folder):
+    ip, _, port = folder.rpartition('_')
+    return f"{ip}:{port}" if ip and port.isdigit() else None
+
+
+def _segment_start(name):
+    return int(name.split('.', 1)[0].split('-', 1)[0]) / 1000
+
+
+class _Segment:
+    def __init__(self, base, start, buffer_size):
+        self.base = base
+        self.start = start
+        self.last = start
+        self.size = 0
+        self.data = open(base + DATA_SUFFIX, 'ab', buffering=buffer_size)
+        self.index = open(base + INDEX_SUFFIX, 'ab', buffering=64 * 1024)
+
+    def write(self, data, timestamp):
+        self.data.write(data)
+        self.index.write(INDEX_RECORD.pack(timestamp, self.size, len(data)))
+        self.size += len(data)
+        self.last = timestamp
+
+    # Сначала данные, потом индекс: читатель не увидит запись без кадра
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        self.data.close()
+        self.index.close()
+
+
+# Непрерывная запись кадров всех клиентов на диск. Кадры попадают в
+# ограниченную очередь без ожидания (если диск не успевает - кадр
+# пропускается, приём никогда не ждёт записи), пишет один поток с
+# буферизованными файлами. Сегменты меняются каждые segment_seconds,
+# самые старые удаляются, когда папка больше quota_bytes.
+class Recorder:
+    def __init__(self, root, segment_seconds, quota_bytes, queue_size,
+                 flush_interval=1.0, buffer_size=1024 * 1024, tag=None):
+        self.root = root
+        self.segment_seconds = segment_seconds
+        self.quota_bytes = quota_bytes
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.tag = tag  # Отличает файлы разных процессов приёма
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._segments = {}  # {источник: _Segment}, только в потоке записи
+        self._thread = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+        logging.info(f"Запись кадров в {os.path.abspath(self.root)} включена.")
+
+    # Обработчик новых кадров для кольца клиента
+    def listener(self, source):
+        def record(data, timestamp, meta=None):
+            try:
+                self._queue.put_nowait((source, data, timestamp))
+            except queue.Full:
+                self.dropped += 1
+        return record
+
+    def _run(self):
+        next_flush = time.time() + self.flush_interval
+        while True:
+            try:
+                source, data, timestamp = self._queue.get(timeout=self.flush_interval)
+                self._write(source, data, timestamp)
+            except queue.Empty:
+                pass
+            except OSError as e:
+                logging.error(f"Ошибка записи кадра: {e}")
+            now = time.time()
+            if now >= next_flush:
+                next_flush = now + self.flush_interval
+                self._flush(now)
+
+    def _write(self, source, data, timestamp):
+        segment = self._segments.get(source)
+        if segment is not None and timestamp - segment.start >= self.segment_seconds:
+            segment.close()
+            segment = None
+            self._enforce_quota()
+        if segment is None:
+            folder = os.path.join(self.root, _folder(source))
+            os.makedirs(folder, exist_ok=True)
+            name = str(int(timestamp * 1000)) + (f"-{self.tag}" if self.tag is not None else "")
+            segment = _Segment(os.path.join(folder, name), timestamp, self.buffer_size)
+            self._segments[source] = segment
+        segment.write(data, timestamp)
+        self.recorded += 1
+
+    def _flush(self, now):
+        for source, segment in list(self._segments.items()):
+            try:
+                # Клиент давно молчит - закрываем сегмент, не держим файлы
+                if now - segment.last >= self.segment_seconds:
+                    segment.close()
+                    del self._segments[source]
+                else:
+                    segment.flush()
+            except OSError as e:
+                logging.error(f"Ошибка записи сегмента {segment.base}: {e}")
+
+    # Удаляем самые старые сегменты (кроме открытых), пока не влезем в квоту
+    def _enforce_quota(self):
+        segments = []
+        total = 0
+        for source in os.listdir(self.root):
+            folder = os.path.join(self.root, source)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                total += size
+                if name.endswith(DATA_SUFFIX):
+                    segments.append((_segment_start(name), path[:-len(DATA_SUFFIX)]))
+        if total <= self.quota_bytes:
+            return
+
+        open_bases = {segment.base for segment in self._segments.values()}
+        for _, base in sorted(segments):
+            if total <= self.quota_bytes:
+                break
+            if base in open_bases:
+                continue
+            for suffix in (DATA_SUFFIX, INDEX_SUFFIX):
+                try:
+                    total -= os.path.getsize(base + suffix)
+                    os.remove(base + suffix)
+                except OSError:
+                    pass  # Уже удалил другой процесс
+            logging.info(f"Квота записи: удалён сегмент {base}.")
+
+
+# Чтение записей для веба. Файлы отображаются в память через mmap, кадры
+# отдаются memoryview на отображение - без копирования в Python. Методы
+# читают диск, из цикла событий их вызывают в пуле потоков.
+class Recordings:
+    def __init__(self, root):
+        self.root = root
+
+    # Клиенты "ip:port", у которых есть записи
+    def sources(self):
+        try:
+            names = [name for name in os.listdir(self.root)
+                     if os.path.isdir(os.path.join(self.root, name))]
+        except FileNotFoundError:
+            return []
+        return sorted(source for source in map(_source, names) if source is not None)
+
+    # [(начало, путь без расширения)] по времени начала
+    def segments(self, source):
+        if source not in self.sources():
+            return []
+        folder = os.path.join(self.root, _folder(source))
+        return sorted((_segment_start(name), os.path.join(folder, name[:-len(DATA_SUFFIX)]))
+                      for name in os.listdir(folder) if name.endswith(DATA_SUFFIX))
+
+    def segment_info(self, source):
+        result = []
+        for start, base in self.segments(source):
+            mapped = self._map(base)
+            if mapped is None:
+                continue
+            index, _, count = mapped
+            result.append({
+                "start": start,
+                "end": INDEX_RECORD.unpack_from(index, (count - 1) * INDEX_RECORD.size)[0],
+                "frames": count,
+                "bytes": os.path.getsize(base + DATA_SUFFIX),
+            })
+        return result
+
+    # Последний кадр не позже timestamp (или первый после, если раньше ничего нет)
+    def frame_at(self, source, timestamp):
+        segments = self.segments(source)
+        if not segments:
+            return None
+        pos = max(0, bisect.bisect_right([start for start, _ in segments], timestamp) - 1)
+        # Сегмент мог оказаться пустым или начаться позже - смотрим соседей
+        for start, base in segments[pos::-1] + segments[pos + 1:]:
+            mapped = self._map(base)
+            if mapped is None:
+                continue
+            index, data, count = mapped
+            i = max(0, bisect.bisect_right(_IndexTimes(index, count), timestamp) - 1)
+            return _record(index, data, i)
+        return None
+
+    # Кадры из [start, end] по порядку
+    def frames(self, source, start, end):
+        segments = self.segments(source)
+        first = max(0, bisect.bisect_right([s for s, _ in segments], start) - 1)
+        number = 0
+        for segment_start, base in segments[first:]:
+            if segment_start > end:
+                break
+            mapped = self._map(base)
+            if mapped is None:
+                continue
+            index, data, count = mapped
+            # Кадр ровно в start тоже входит в отрезок
+            for i in range(bisect.bisect_left(_IndexTimes(index, count), start), count):
+                timestamp, view = _record(index, data, i)
+                if timestamp > end:
+                    return
+                number += 1
+                yield Frame(number, view, timestamp)
+
+    # (индекс, данные, число записей) или None, если сегмент пуст. Записи,
+    # чьи кадры ещё не сброшены на диск, не учитываются.
+    def _map(self, base):
+        try:
+            with open(base + INDEX_SUFFIX, 'rb') as f_index, open(base + DATA_SUFFIX, 'rb') as f_data:
+                index = mmap.mmap(f_index.fileno(), 0, access=mmap.ACCESS_READ)
+                data = mmap.mmap(f_data.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None  # Нет файла или он пустой
+        count = len(index) // INDEX_RECORD.size
+        while count:
+            _, offset, size = INDEX_RECORD.unpack_from(index, (count - 1) * INDEX_RECORD.size)
+            if offset + size <= len(data):
+                break
+            count -= 1
+        if not count:
+            return None
+        return index, data, count
+
+
+def _record(index, data, i):
+    timestamp, offset, size = INDEX_RECORD.unpack_from(index, i * INDEX_RECORD.size)
+    return timestamp, memoryview(data)[offset:offset + size]
+
+
+# Времена записей индекса как последовательность для bisect, без чтения всего индекса
+class _IndexTimes:
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return INDEX_RECORD.unpack_from(self.index, i * INDEX_RECORD.size)[0]
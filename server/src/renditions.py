@@ -0,0 +1,76 @@
+import asyncio
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from imaging import decode_scaled, draw_overlay, encode_jpeg, jpeg_size
+
+
+# width=None - исходный размер; meta - нанести надпись из метаданных кадра
+def _render(data, width, quality, meta):
+    if width is None:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        image = decode_scaled(data, width)
+    if image is None:
+        return None
+    if meta is not None:
+        size = jpeg_size(data)
+        draw_overlay(image, meta, image.shape[1] / size[0] if size else 1.0)
+    return encode_jpeg(image, quality)
+
+
+# Кэш уменьшенных копий кадров по ключу (клиент, id кадра, ширина, качество,
+# надпись). Надпись наносится только если её попросили и у кадра есть
+# метаданные (клиент в режиме MJPEG без перекодирования). Копия делается
+# только по запросу и не больше одного раза на кадр: одновременные
+# запросы ждут одну и ту же задачу в пуле. Старые копии вытесняются по
+# LRU, когда суммарный размер превышает max_bytes.
+# Все методы вызываются из цикла событий, поэтому блокировки не нужны.
+class RenditionCache:
+    def __init__(self, executor, max_bytes):
+        self.executor = executor
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()  # {key: bytes}
+        self._pending = {}  # {key: asyncio.Future}
+
+    async def get(self, client, frame, width, quality, overlay=False):
+        meta = frame.meta if overlay else None
+        if width is None and meta is None:
+            return frame.data  # Менять нечего, отдаём кадр как есть
+        key = (client.session, frame.id, width, quality, meta is not None)
+        data = self._items.get(key)
+        if data is not None:
+            self._items.move_to_end(key)
+            return data
+
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, _render, frame.data, width, quality, meta)
+            self._pending[key] = future
+            future.add_done_callback(lambda f: self._store(key, f))
+        # shield: отключившийся зритель не отменяет работу для остальных
+        return await asyncio.shield(future)
+
+    # Кадры потока, заменённые уменьшенными копиями
+    async def frames(self, client, frames, width, quality, overlay=False):
+        async for frame in frames:
+            data = await self.get(client, frame, width, quality, overlay)
+            if data is not None:
+                yield frame._replace(data=data)
+
+    def _store(self, key, future):
+        self._pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        data = future.result()
+        if data is None:
+            return
+        self._items[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes and self._items:
+            _, old = self._items.popitem(last=False)
+            self.size -= len(old)
@@ -0,0 +1,312 @@
+import logging
+import mmap
+import multiprocessing
+import os
+import secrets
+import signal
+import struct
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+from config import (INGEST_PROCESSES, SHM_CLIENTS, SHM_CLIENT_BYTES, SHM_FRAMES,
+                    NACK_ENABLED, STATS_INTERVAL, RECORDING_ENABLED, SHARD_STATS_INTERVAL)
+from frame_ring import FrameRing
+from metrics import ingest_snapshot, server_snapshot
+from udp_server import (BatchUDPServer, ClientsMixin, make_recorder, cleanup_inactive_clients,
+                        request_missing_packets, report_link_stats)
+
+# В начале участка клиента - сколько байт всего записано в его кольцо
+# (логическая позиция записи, растёт всё время, пока живёт сервер)
+SHM_HEAD = struct.Struct('Q')
+
+
+# Запись кадров одного клиента в его участок общей памяти. Участок - кольцо
+# байт: кадр пишется за предыдущим, если не влезает - с начала. Веб может
+# отстать и прочитать кадр, когда его место уже занято новыми, поэтому позиция записи сдвигается в SHM_HEAD до того, как
+# пишутся байты, а веб после копирования кадра сверяет её с позицией кадра.
+class SharedFrameWriter:
+    def __init__(self, server, slot, base, size):
+        self.server = server
+        self.slot = slot
+        self.head = base
+        self.base = base + SHM_HEAD.size
+        self.size = size - SHM_HEAD.size
+        self.max_frame = self.size // SHM_FRAMES
+        self.client = None  # Client, чьё состояние (idle) передаём вместе с кадром
+        self.closed = False
+        self.listener = None  # Запись на диск ведёт сам процесс приёма
+        # Участок мог достаться от отключившегося клиента - продолжаем его позицию,
+        # чтобы веб распознал затёртые кадры прежнего владельца
+        self._written = SHM_HEAD.unpack_from(server.store, base)[0]
+        self._lock = threading.Lock()  # Кадры пишут потоки приёма и пул холстов
+
+    def append(self, data, meta=None):
+        size = len(data)
+        if size > self.max_frame:
+            logging.warning(f"Кадр {size} байт не помещается в общую память (максимум {self.max_frame}).")
+            return
+        with self._lock:
+            if self.closed:
+                return
+            pos = self._written % self.size
+            if pos + size > self.size:
+                self._written += self.size - pos  # Хвост кольца пропускаем
+                pos = 0
+            position = self._written
+            self._written += size
+            SHM_HEAD.pack_into(self.server.store, self.head, self._written)
+            start = self.base + pos
+            self.server.store[start:start + size] = data
+            idle = self.client.idle if self.client is not None else False
+            self.server.post_frame(self.slot, ("frame", self.server.shard, self.slot, position, size, meta, idle))
+        if self.listener is not None:
+            self.listener(data, time.time(), meta)
+
+    # Кадры читает только веб-процесс
+    def latest(self):
+        return None
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.server.send_to_web(("disconnect", self.server.shard, self.slot))
+        self.server.release_slot(self.slot)
+
+
+# Процесс приёма: обычный BatchUDPServer на общем порту (SO_REUSEPORT).
+# Сборка кадров, nack, отчёты и таймауты - здесь, веб-процессу уходят только
+# события о клиентах, положение готовых кадров в общей памяти и счётчики.
+# В pipe пишет отдельный поток: если веб (он делит GIL с uvicorn) не успевает
+# читать, потоки приёма не ждут его, а сообщение о кадре участка заменяется
+# сообщением о более новом кадре - веб всё равно показывает только последний.
+class ShardUDPServer(BatchUDPServer):
+    def __init__(self, server_address, shard, store, conn):
+        super().__init__(server_address, reuse_port=True)
+        self.shard = shard
+        self.store = store
+        self._conn = conn
+        self._outbox = deque()  # Служебные сообщения вебу, по порядку
+        self._frame_notices = {}  # {участок: сообщение о последнем кадре}
+        self._outbox_ready = threading.Condition()
+        self.notices_coalesced = 0  # Сообщения о кадрах, заменённые более новыми
+        self._free_slots = deque(range(SHM_CLIENTS))
+
+    def send_to_web(self, message):
+        with self._outbox_ready:
+            if message[0] == "disconnect":
+                # Участок отдадут другому клиенту - кадр прежнего ему не показываем
+                self._frame_notices.pop(message[2], None)
+            self._outbox.append(message)
+            self._outbox_ready.notify()
+
+    def post_frame(self, slot, message):
+        with self._outbox_ready:
+            if slot in self._frame_notices:
+                self.notices_coalesced += 1
+            self._frame_notices[slot] = message
+            self._outbox_ready.notify()
+
+    # Служебные сообщения уходят раньше кадров: connect нового клиента должен
+    # дойти до его первого кадра
+    def _send_loop(self):
+        while True:
+            with self._outbox_ready:
+                while not self._outbox and not self._frame_notices and not self._stop.is_set():
+                    self._outbox_ready.wait()
+                if self._stop.is_set():
+                    return
+                messages = list(self._outbox)
+                self._outbox.clear()
+                messages.extend(self._frame_notices.values())
+                self._frame_notices = {}
+            try:
+                for message in messages:
+                    self._conn.send(message)
+            except (OSError, EOFError):
+                logging.error("Веб-процесс недоступен, процесс приёма выключается.")
+                self.shutdown()
+
+    def shutdown(self):
+        super().shutdown()
+        with self._outbox_ready:
+            self._outbox_ready.notify()
+
+    def serve_forever(self):
+        sender = threading.Thread(target=self._send_loop, daemon=True)
+        sender.start()
+        super().serve_forever()
+
+    def make_frames(self, client_addr):
+        if not self._free_slots:
+            logging.error(f"Нет места в общей памяти для {client_addr}.")
+            return None
+        slot = self._free_slots.popleft()
+        base = (self.shard * SHM_CLIENTS + slot) * SHM_CLIENT_BYTES
+        self.send_to_web(("connect", self.shard, slot, client_addr))
+        return SharedFrameWriter(self, slot, base, SHM_CLIENT_BYTES)
+
+    def get_or_create_client(self, client_addr):
+        client = super().get_or_create_client(client_addr)
+        if client is not None:
+            client.frames.client = client
+        return client
+
+    # Освободившийся участок отдаём последним, чтобы он дольше не перезаписывался
+    def release_slot(self, slot):
+        self._free_slots.append(slot)
+
+
+# Процесс приёма не должен пережить веб-процесс и держать порт
+def watch_parent(server, parent_pid):
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    logging.error("Веб-процесс завершился, процесс приёма выключается.")
+    server.shutdown()
+
+
+# Счётчики приёма для /metrics: сборщики живут только здесь, веб получает
+# их снимок раз в SHARD_STATS_INTERVAL
+def forward_stats(server):
+    server.server_ready.wait()
+    while True:
+        time.sleep(SHARD_STATS_INTERVAL)
+        clients = {addr: ingest_snapshot(client) for addr, client in server.clients.items()}
+        server.send_to_web(("stats", server.shard, None, server_snapshot(server), clients))
+
+
+def run_shard(shard, server_address, store, conn, parent_pid):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C обрабатывает веб-процесс
+    server = ShardUDPServer(server_address, shard, store, conn)
+    if RECORDING_ENABLED:
+        server.recorder = make_recorder(tag=shard)
+    threads = [threading.Thread(target=cleanup_inactive_clients, args=(server,)),
+               threading.Thread(target=watch_parent, args=(server, parent_pid)),
+               threading.Thread(target=forward_stats, args=(server,))]
+    if NACK_ENABLED:
+        threads.append(threading.Thread(target=request_missing_packets, args=(server,)))
+    if STATS_INTERVAL:
+        threads.append(threading.Thread(target=report_link_stats, args=(server,)))
+    for t in threads:
+        t.daemon = True
+        t.start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+# Клиент процесса приёма, как его видит веб: кадры лежат в общей памяти
+class SharedClient:
+    def __init__(self, ip, port, frames):
+        self.ip = ip
+        self.port = port
+        self.session = secrets.token_hex(4)
+        self.frames = frames
+        self.idle = False
+        self.last_activity = time.time()
+        self.ingest = None  # Последний снимок счётчиков приёма от процесса (metrics.ingest_snapshot)
+
+    @property
+    def state(self):
+        return "idle" if self.idle else "active"
+
+
+# Веб-процесс в режиме multiprocess. Запускает processes процессов приёма
+# на одном порту, ядро раскладывает клиентов по ним по адресу отправителя.
+# Кадры процессы пишут в общую анонимную память (mmap, наследуется при
+# fork), а сюда по pipe присылают только где кадр лежит. Веб копирует кадр
+# в FrameRing клиента (одно копирование на кадр, дальше все зрители
+# работают с копией) и выбрасывает его, если пока сообщение шло, место
+# кадра уже заняли новые. nack и отчёты клиентам шлют процессы приёма,
+# команды - web_server через свой сокет, поэтому служебного сокета здесь нет.
+class ShardedServer(ClientsMixin):
+    def __init__(self, server_address, processes=INGEST_PROCESSES):
+        self.init_clients(control=False)
+        self.store = mmap.mmap(-1, processes * SHM_CLIENTS * SHM_CLIENT_BYTES)
+        self._view = memoryview(self.store)
+        self.overwritten = 0  # Кадры, затёртые в общей памяти до того, как веб их прочитал
+        self.shard_stats = {}  # {процесс: metrics.server_snapshot} для /metrics
+        self._slots = {}  # {(процесс, участок): SharedClient}
+        self._stop = threading.Event()
+        self._conns = []
+        self._processes = []
+
+        # Процессы создаются сразу, пока в веб-процессе нет других потоков
+        context = multiprocessing.get_context("fork")
+        for shard in range(processes):
+            reader, writer = context.Pipe(duplex=False)
+            process = context.Process(target=run_shard, name=f"ingest-{shard}",
+                                      args=(shard, server_address, self.store, writer, os.getpid()))
+            process.daemon = True
+            process.start()
+            writer.close()
+            self._conns.append(reader)
+            self._processes.append(process)
+
+    def serve_forever(self):
+        self.server_ready.set()
+        logging.info(f"Сервер запускается (multiprocess, процессов: {len(self._processes)})...")
+        try:
+            while self._conns and not self._stop.is_set():
+                for conn in wait(self._conns, timeout=0.5):
+                    try:
+                        message = conn.recv()
+                    except EOFError:
+                        self._conns.remove(conn)
+                        logging.error("Процесс приёма завершился.")
+                        continue
+                    self._dispatch(message)
+        finally:
+            logging.info("Сервер выключен.")
+
+    def _dispatch(self, message):
+        kind, shard, slot = message[:3]
+        if kind == "frame":
+            client = self._slots.get((shard, slot))
+            if client is None:
+                return
+            position, size, meta, idle = message[3:]
+            head = (shard * SHM_CLIENTS + slot) * SHM_CLIENT_BYTES
+            ring = SHM_CLIENT_BYTES - SHM_HEAD.size
+            start = head + SHM_HEAD.size + position % ring
+            data = self._view[start:start + size].tobytes()
+            if idle != client.idle:
+                client.idle = idle
+                self.presence.publish("state", f"{client.ip}:{client.port}", client.state)
+            client.last_activity = time.time()
+            # Процесс приёма уже записал поверх начала кадра - копия могла порваться
+            if SHM_HEAD.unpack_from(self.store, head)[0] - position > ring:
+                self.overwritten += 1
+                return
+            client.frames.append(memoryview(data), meta)
+        elif kind == "connect":
+            client_addr = message[3]
+            client = SharedClient(*client_addr, FrameRing())
+            self._slots[(shard, slot)] = client
+            with self.clients_lock:
+                self.clients = {**self.clients, client_addr: client}
+                self.presence.publish("join", f"{client_addr[0]}:{client_addr[1]}", client.state)
+        elif kind == "stats":
+            server_stats, client_stats = message[3:]
+            self.shard_stats[shard] = server_stats
+            for client_addr, snapshot in client_stats.items():
+                client = self.clients.get(client_addr)
+                if client is not None:
+                    client.ingest = snapshot
+        elif kind == "disconnect":
+            client = self._slots.pop((shard, slot), None)
+            if client is not None:
+                self.remove_client((client.ip, client.port), client)
+
+    def shutdown(self):
+        self._stop.set()
+        for process in self._processes:
+            process.terminate()
+
+    def server_close(self):
+        for process in self._processes:
+            process.join(timeout=2)
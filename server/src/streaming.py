@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from starlette.concurrency import iterate_in_threadpool
+
+MJPEG_MEDIA_TYPE = "multipart/x-mixed-replace; boundary=frame"
+NO_CACHE_HEADERS = {"Cache-Control": "no-cache, no-store, must-revalidate"}
+
+_CRLF = b'\r\n'
+
+
+# Самый свежий кадр кольца каждый раз, когда зритель готов его принять.
+# Пока ответ медленного зрителя не ушёл в сокет, генератор стоит на yield,
+# а кадры копятся только в кольце; после этого зритель сразу получает
+# последний кадр, промежуточные пропускаются. Блокировки приёма не берутся.
+async def latest_frames(ring, start=None):
+    # По умолчанию начинаем с уже имеющегося кадра, чтобы картинка была сразу
+    cursor = max(ring.last_id - 1, 0) if start is None else start
+    while not ring.closed:
+        await ring.wait(cursor)
+        frame = ring.latest()
+        if frame is None or frame.id <= cursor:
+            continue
+        cursor = frame.id
+        yield frame
+
+
+# Записанные кадры (recorder.Recordings.frames) в темпе записи, ускоренном
+# в speed раз; speed=0 - без пауз, как быстро примет зритель. Генератор
+# читает диск, поэтому идёт в пуле потоков, а не в цикле событий.
+async def replay_frames(frames, speed=1.0):
+    started = first = None
+    async for frame in iterate_in_threadpool(frames):
+        if speed > 0:
+            now = time.monotonic()
+            if first is None:
+                started, first = now, frame.timestamp
+            delay = (frame.timestamp - first) / speed - (now - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            await asyncio.sleep(0)  # Отдаём цикл событий другим зрителям
+        yield frame
+
+
+# Части multipart-ответа. Кадр отдаётся как есть, без склейки с заголовком,
+# поэтому все зрители отправляют один и тот же буфер.
+async def mjpeg_stream(frames):
+    async for frame in frames:
+        yield (b'--frame\r\n'
+               b'Content-Type: image/jpeg\r\n'
+               b'Content-Length: %d\r\n\r\n' % len(frame.data))
+        yield frame.data
+        yield _CRLF
@@ -0,0 +1,110 @@
+import logging
+import struct
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from imaging import encode_jpeg
+
+# Кадр клиента в режиме дельт (собирается в client/src/tiles.py):
+# тип, номер опорного кадра, ширина, высота, размер плитки, число плиток.
+DELTA_HEADER = struct.Struct('!BIHHHH')
+TILE_HEADER = struct.Struct('!HHI')
+KIND_KEY = 0
+KIND_DELTA = 1
+
+
+# Холст клиента для дельт: опорный кадр + изменившиеся плитки. Опорный
+# JPEG уходит зрителям как есть, для дельты плитки накладываются на копию
+# опорного кадра и результат кодируется в JPEG, так что /video и
+# /screenshot работают с обычными кадрами. Кадры одного клиента
+# обрабатываются строго по очереди в пуле executor, не в потоке приёма.
+class TileCanvas:
+    def __init__(self, frames, executor, quality, request_keyframe, keyframe_retry=0.5):
+        self.frames = frames
+        self.executor = executor
+        self.quality = quality
+        self.request_keyframe = request_keyframe
+        self.keyframe_retry = keyframe_retry
+        self.dropped = 0  # Дельты без своего опорного кадра
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+
+        # Состояние меняется только внутри _drain
+        self._key_id = None
+        self._key_data = None
+        self._key_image = None  # Декодируется при первой дельте
+        self._last_request = 0.0
+
+    # Кадры, ждущие обработки (для метрик)
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def submit(self, data, meta=None):
+        with self._lock:
+            self._queue.append((data, meta))
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._scheduled = False
+                    return
+                data, meta = self._queue.popleft()
+            try:
+                self._apply(data, meta)
+            except Exception as e:
+                logging.error(f"Ошибка сборки кадра из плиток: {e}")
+
+    def _apply(self, data, meta):
+        kind, key_id, width, height, tile, count = DELTA_HEADER.unpack_from(data)
+        if kind == KIND_KEY:
+            self._key_id = key_id
+            self._key_data = data[DELTA_HEADER.size:]
+            self._key_image = None
+            self.frames.append(self._key_data, meta)
+            return
+
+        if key_id != self._key_id:
+            # Опорный кадр потерян: без него дельту не на что накладывать
+            self.dropped += 1
+            now = time.time()
+            if now - self._last_request >= self.keyframe_retry:
+                self._last_request = now
+                self.request_keyframe()
+            return
+
+        if count == 0:
+            self.frames.append(self._key_data, meta)  # Ничего не изменилось
+            return
+
+        if self._key_image is None:
+            self._key_image = cv2.imdecode(np.frombuffer(self._key_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if self._key_image is None or self._key_image.shape[:2] != (height, width):
+                raise ValueError("опорный кадр не декодируется")
+        canvas = self._key_image.copy()
+
+        pos = DELTA_HEADER.size
+        for _ in range(count):
+            col, row, size = TILE_HEADER.unpack_from(data, pos)
+            pos += TILE_HEADER.size
+            image = cv2.imdecode(np.frombuffer(data[pos:pos + size], dtype=np.uint8), cv2.IMREAD_COLOR)
+            pos += size
+            if image is None:
+                continue
+            y, x = row * tile, col * tile
+            canvas[y:y + image.shape[0], x:x + image.shape[1]] = image[:height - y, :width - x]
+
+        jpeg = encode_jpeg(canvas, self.quality)
+        if jpeg is not None:
+            self.frames.append(jpeg, meta)
@@ -0,0 +1,349 @@
+import socketserver
+import time
+import threading
+import socket
+import logging
+import asyncio
+import secrets
+from config import (WHITELIST, TIMEOUT, IDLE_TIMEOUT, MAX_BUFFER_SIZE, CLIENT_RECEIVE_PORT,
+                    INGEST_MODE, INGEST_WORKERS, INGEST_BATCH, UDP_RCVBUF,
+                    MTU_SIZE, REASSEMBLY_SLOTS, SPARE_BUFFERS,
+                    NACK_DELAY, NACK_RETRY, NACK_MAX_ROUNDS, FRAME_DEADLINE,
+                    STATS_INTERVAL, CANVAS_WORKERS, CANVAS_JPEG_QUALITY, KEYFRAME_RETRY,
+                    RECORDINGS_DIR, RECORDING_SEGMENT, RECORDING_QUOTA,
+                    RECORDING_QUEUE, RECORDING_FLUSH, PRESENCE_HISTORY)
+from frame_ring import FrameRing
+from ingest import drain_socket, DatagramIngest
+from metrics import CountingExecutor, ThreadCounter
+from presence import PresenceBus
+from reassembler import FrameReassembler
+from recorder import Recorder
+from protocol import parse_packet, FLAG_IDLE, FLAG_DELTA
+from tile_canvas import TileCanvas
+
+# Пул для сборки кадров из плиток, общий для всех клиентов
+canvas_executor = CountingExecutor(CANVAS_WORKERS, thread_name_prefix="canvas")
+
+class Client:
+    def __init__(self, ip, port, send_control=None, frames=None, presence=None):
+        self.ip = ip
+        self.port = port
+        self.last_activity = time.time()
+        self.session = secrets.token_hex(4)  # Отличает ETag'и кадров после переподключения
+        self.lock = threading.Lock()  # Пакеты одного клиента могут прийти из разных потоков
+        self.reassembler = FrameReassembler(MTU_SIZE, REASSEMBLY_SLOTS, MAX_BUFFER_SIZE, SPARE_BUFFERS)
+        self.frames = frames if frames is not None else FrameRing()  # Последний собранный фрейм
+        self.idle = False  # Клиент сообщил, что сцена неподвижна
+        self.canvas = None  # Холст для дельт, создаётся по первому такому кадру
+        self._send_control = send_control
+        self._presence = presence  # PresenceBus, куда сообщаем о смене состояния
+        # Ожидание self.lock пакетами (только когда блокировка была занята)
+        self.lock_waits = 0
+        self.lock_wait_seconds = 0.0
+        self._stats_prev = (time.time(), (0, 0, 0, 0, 0))
+
+    @property
+    def state(self):
+        return "idle" if self.idle else "active"
+
+    # Неподвижный клиент шлёт кадры редко, ждём его дольше
+    @property
+    def timeout(self):
+        return IDLE_TIMEOUT if self.idle else TIMEOUT
+
+    def add_packet(self, packet):
+        idle = bool(packet.flags & FLAG_IDLE)
+        # Время меряем, только если блокировку пришлось ждать
+        if not self.lock.acquire(blocking=False):
+            started = time.perf_counter()
+            self.lock.acquire()
+            self.lock_waits += 1
+            self.lock_wait_seconds += time.perf_counter() - started
+        try:
+            # Пакеты клиента идут из разных потоков: смену состояния и создание
+            # холста делаем под блокировкой, чтобы они случились ровно один раз
+            if idle != self.idle:
+                self.idle = idle
+                logging.info(f"{(self.ip, self.port)} " + ("без движения." if idle else "снова активен."))
+                if self._presence is not None:
+                    self._presence.publish("state", f"{self.ip}:{self.port}", self.state)
+            frame = self.reassembler.add(packet)
+            if frame is not None and packet.flags & FLAG_DELTA and self.canvas is None:
+                self.canvas = TileCanvas(self.frames, canvas_executor, CANVAS_JPEG_QUALITY,
+                                         self.request_keyframe, KEYFRAME_RETRY)
+        finally:
+            self.lock.release()
+        if frame is None:
+            return
+        # Метаданные одинаковы во всех пакетах кадра, берём из последнего
+        if packet.flags & FLAG_DELTA:
+            self.canvas.submit(frame, packet.meta)
+        else:
+            self.frames.append(frame, packet.meta)
+
+    def request_keyframe(self):
+        if self._send_control is not None:
+            logging.info(f"{(self.ip, self.port)}: нет опорного кадра, запрашиваем.")
+            self._send_control(self.ip, "keyframe")
+
+    # Показатели канала с прошлого вызова: доля потерянных пакетов, доля
+    # собранных кадров, собранные кадры в секунду и полезный поток
+    def link_stats(self):
+        now = time.time()
+        r = self.reassembler
+        with self.lock:
+            counters = (r.expected_packets, r.original_packets, r.completed,
+                        r.evicted, r.completed_bytes)
+        (prev_time, prev), self._stats_prev = self._stats_prev, (now, counters)
+        expected, original, completed, evicted, good_bytes = (
+            c - p for c, p in zip(counters, prev))
+        elapsed = max(now - prev_time, 1e-3)
+        return {
+            "loss": 1 - original / expected if expected else 0.0,
+            "done": completed / (completed + evicted) if completed + evicted else 1.0,
+            "fps": completed / elapsed,
+            "kbps": good_bytes * 8 / 1000 / elapsed,
+        }
+
+# Общее для всех режимов приёма: список клиентов, команды и разбор датаграмм
+class ClientsMixin:
+    # Список клиентов - неизменяемый снимок {client_addr: Client}. Добавление
+    # и удаление (редкие) под clients_lock собирают новый словарь и подменяют
+    # ссылку одним присваиванием, поэтому приём пакетов, веб и фоновые потоки
+    # читают self.clients без блокировок и никогда не видят его посередине
+    # изменения. Снимок нельзя менять на месте - только через add/remove.
+    def init_clients(self, control=True):
+        self.clients = {}
+        self.server_ready = threading.Event()
+        self.clients_lock = threading.Lock()  # Только для добавления и удаления
+        self.presence = PresenceBus(PRESENCE_HISTORY)  # События о клиентах для /stream
+        self.recorder = None  # Recorder, если кадры пишутся на диск
+        # Счётчики по потокам приёма, чтобы не терять увеличения без блокировки
+        self.datagram_errors = ThreadCounter()  # Датаграммы, которые не удалось разобрать
+        self.rejected = ThreadCounter()  # Датаграммы с адресов не из WHITELIST
+        # Постоянный сокет для служебных сообщений клиентам (nack, stats).
+        # control=False - сервер их не шлёт (веб-процесс режима multiprocess)
+        self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if control else None
+
+    def send_control(self, ip, message):
+        try:
+            self.control_socket.sendto(message.encode(), (ip, CLIENT_RECEIVE_PORT))
+            return True
+        except OSError as e:
+            logging.error(f"Ошибка отправки служебного сообщения клиенту {ip}: {e}")
+            return False
+
+    def send_nack(self, ip, packet_seq, bitmap):
+        self.send_control(ip, f"nack {packet_seq} {bitmap.hex()}")
+
+    # Куда складывать собранные кадры клиента. None - принять клиента некуда
+    def make_frames(self, client_addr):
+        return FrameRing()
+
+    def get_or_create_client(self, client_addr):
+        client = self.clients.get(client_addr)
+        if client is not None:
+            return client
+        with self.clients_lock:
+            client = self.clients.get(client_addr)
+            if client is None:
+                frames = self.make_frames(client_addr)
+                if frames is None:
+                    return None
+                if self.recorder is not None:
+                    frames.listener = self.recorder.listener(f"{client_addr[0]}:{client_addr[1]}")
+                client = Client(*client_addr, self.send_control, frames, self.presence)
+                self.clients = {**self.clients, client_addr: client}
+                self.presence.publish("join", f"{client_addr[0]}:{client_addr[1]}", client.state)
+                logging.info(f"{client_addr} подключился.")
+            return client
+
+    # expected - удалить, только если по адресу всё ещё этот клиент
+    def remove_client(self, client_addr, expected=None):
+        with self.clients_lock:
+            client = self.clients.get(client_addr)
+            if client is None or (expected is not None and client is not expected):
+                return None
+            clients = dict(self.clients)
+            del clients[client_addr]
+            self.clients = clients
+            self.presence.publish("leave", f"{client_addr[0]}:{client_addr[1]}")
+        # Будим зрителей, чтобы их потоки завершились
+        client.frames.close()
+        return client
+
+    # Обработка одной датаграммы. data может быть memoryview на буфер
+    # приёмного цикла, поэтому ссылку на неё нельзя сохранять.
+    def handle_datagram(self, data, client_addr):
+        try:
+            # Обычный случай - один поиск в снимке без блокировок
+            client = self.clients.get(client_addr)
+            if client is None:
+                if WHITELIST and client_addr[0] not in WHITELIST:
+                    self.rejected.add()
+                    return
+                client = self.get_or_create_client(client_addr)
+                if client is None:
+                    return
+            client.last_activity = time.time()
+
+            # Разбираем заголовок, полезная нагрузка копируется сразу в слот сборщика
+            packet = parse_packet(data)
+
+            # Добавляем пакет в буфер клиента, собранный фрейм попадёт в client.frames
+            client.add_packet(packet)
+
+        except Exception as e:
+            self.datagram_errors.add()
+            logging.error(f"Ошибка при обработке данных от {client_addr}: {e}")
+
+class ThreadedUDPServer(ClientsMixin, socketserver.ThreadingMixIn, socketserver.UDPServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.init_clients()
+
+    def serve_forever(self):
+        self.server_ready.set()
+        logging.info("Сервер запускается...")
+        try:
+            super().serve_forever()
+            logging.info("Сервер запущен без ошибок.")
+        finally:
+            logging.info("Сервер выключен.")
+
+    def shutdown(self):
+        super().shutdown()
+
+class UDPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, socket = self.request
+        self.server.handle_datagram(data, self.client_address)
+
+# reuse_port - несколько процессов на одном порту, ядро делит клиентов между ними
+def bind_udp_socket(server_address, reuse_port=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(server_address)
+    sock.setblocking(False)
+    return sock
+
+# Приём пачками в нескольких постоянных потоках
+class BatchUDPServer(ClientsMixin):
+    def __init__(self, server_address, workers=INGEST_WORKERS, batch=INGEST_BATCH, reuse_port=False):
+        self.socket = bind_udp_socket(server_address, reuse_port)
+        self.workers = workers
+        self.batch = batch
+        self._stop = threading.Event()
+        self.init_clients()
+
+    def serve_forever(self):
+        threads = [
+            threading.Thread(target=drain_socket,
+                             args=(self.socket, self.handle_datagram, self.batch, self._stop))
+            for _ in range(self.workers)
+        ]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        self.server_ready.set()
+        logging.info(f"Сервер запускается (batch, потоков: {self.workers})...")
+        try:
+            while not self._stop.wait(1):
+                pass
+        finally:
+            logging.info("Сервер выключен.")
+
+    def shutdown(self):
+        self._stop.set()
+
+    def server_close(self):
+        self.socket.close()
+
+# Приём через asyncio в том же цикле событий, что и uvicorn
+class AsyncUDPServer(ClientsMixin):
+    def __init__(self, server_address):
+        self.socket = bind_udp_socket(server_address)
+        self.init_clients()
+
+    async def serve(self, web_server):
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramIngest(self), sock=self.socket)
+        self.server_ready.set()
+        logging.info("Сервер запускается (asyncio)...")
+        try:
+            await web_server.serve()
+        finally:
+            transport.close()
+            logging.info("Сервер выключен.")
+
+    def server_close(self):
+        self.socket.close()
+
+def make_server(server_address, mode=INGEST_MODE):
+    if mode == "threaded":
+        server = ThreadedUDPServer(server_address, UDPHandler)
+        server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        return server
+    if mode == "batch":
+        return BatchUDPServer(server_address)
+    if mode == "asyncio":
+        return AsyncUDPServer(server_address)
+    if mode == "multiprocess":
+        from sharding import ShardedServer
+        return ShardedServer(server_address)
+    raise ValueError(f"Неизвестный режим приёма: {mode}")
+
+def cleanup_inactive_clients(server):
+    server.server_ready.wait()
+    logging.info("Поток удаление неактивных клиентов успешно запущен.")
+    while True:
+        time.sleep(5)
+        current_time = time.time()
+        inactive_clients = [
+            (addr, client) for addr, client in server.clients.items()
+            if current_time - client.last_activity > client.timeout
+        ]
+        for addr, client in inactive_clients:
+            if server.remove_client(addr, client) is not None:
+                logging.warning(f"{addr} отключен по таймауту.")
+
+# Запрос у клиентов пакетов, потерянных в недособранных кадрах
+def request_missing_packets(server):
+    server.server_ready.wait()
+    logging.info("Поток запроса потерянных пакетов успешно запущен.")
+    while True:
+        time.sleep(NACK_DELAY)
+        now = time.time()
+        clients = server.clients.values()
+        for client in clients:
+            if not client.reassembler.has_pending:
+                continue
+            with client.lock:
+                reports = client.reassembler.nack_candidates(
+                    now, NACK_DELAY, NACK_RETRY, FRAME_DEADLINE, NACK_MAX_ROUNDS)
+            for packet_seq, bitmap in reports:
+                server.send_nack(client.ip, packet_seq, bitmap)
+
+# Периодический отчёт клиентам о качестве канала для подстройки битрейта
+def report_link_stats(server):
+    server.server_ready.wait()
+    logging.info("Поток отчётов о качестве канала успешно запущен.")
+    while True:
+        time.sleep(STATS_INTERVAL)
+        clients = server.clients.values()
+        for client in clients:
+            stats = client.link_stats()
+            server.send_control(
+                client.ip,
+                f"stats loss={stats['loss']:.3f} done={stats['done']:.3f} "
+                f"fps={stats['fps']:.1f} kbps={stats['kbps']:.0f}"
+            )
+
+def make_recorder(tag=None):
+    recorder = Recorder(RECORDINGS_DIR, RECORDING_SEGMENT, RECORDING_QUOTA,
+                        RECORDING_QUEUE, RECORDING_FLUSH, tag=tag)
+    recorder.start()
+    return recorder
@@ -0,0 +1,60 @@
+import asyncio
+
+
+def _resolve(futures):
+    for fut in futures:
+        if not fut.done():
+            fut.set_result(None)
+
+
+# Ожидание из asyncio события, которое наступает в другом потоке (новый
+# кадр, событие о клиенте). Ждущий - future в своём цикле событий, будят
+# всех разом одним call_soon_threadsafe на цикл. Условие ожидания хранит
+# владелец под своей блокировкой lock: add и take вызываются под ней, чтобы
+# событие не проскочило между проверкой условия и постановкой в очередь.
+class Waiters:
+    def __init__(self, lock):
+        self._lock = lock
+        self._futures = {}  # {loop: [future, ...]}
+
+    def __len__(self):
+        return sum(len(futures) for futures in self._futures.values())
+
+    # Под lock владельца
+    def add(self):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._futures.setdefault(loop, []).append(fut)
+        return fut
+
+    # Под lock владельца: забрать всех ждущих, будить - уже без блокировки
+    def take(self):
+        futures, self._futures = self._futures, {}
+        return futures
+
+    @staticmethod
+    def wake(futures):
+        # Один вызов на цикл событий, сколько бы ни ждало
+        for loop, loop_futures in futures.items():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve, loop_futures)
+
+    async def wait(self, fut, timeout=None):
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # Не дождались (таймаут или ждущий ушёл) - убираем future сами,
+            # иначе без новых событий они копятся до следующего take
+            if fut.cancelled():
+                self._discard(fut)
+
+    def _discard(self, fut):
+        loop = fut.get_loop()
+        with self._lock:
+            futures = self._futures.get(loop)
+            if futures is not None and fut in futures:
+                futures.remove(fut)
+                if not futures:
+                    del self._futures[loop]
@@ -1,19 +1,32 @@
 import time
 import os
 import logging
-from typing import List, Annotated
+from typing import List, Annotated, Optional
 import secrets
 import asyncio
 
-from fastapi import FastAPI, Response, Request, HTTPException, Depends, Cookie
+from fastapi import FastAPI, Response, Request, HTTPException, Depends, Cookie, Query, WebSocket
 from fastapi.params import Form
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 
 
-from config import TIMEOUT, FPS
+from config import (LONG_POLL_TIMEOUT, IMAGE_WORKERS, MOSAIC_FPS, MOSAIC_TILE_WIDTH,
+                    MOSAIC_TILE_HEIGHT, MOSAIC_JPEG_QUALITY,
+                    RENDITION_CACHE_BYTES, RENDITION_QUALITY, RECORDINGS_DIR,
+                    PRESENCE_KEEPALIVE, CLIENT_RECEIVE_PORT, COMMAND_TIMEOUT, COMMAND_RETRIES,
+                    COMMAND_BATCH, COMMAND_HISTORY)
+from streaming import latest_frames, mjpeg_stream, replay_frames, MJPEG_MEDIA_TYPE, NO_CACHE_HEADERS
+from mosaic import Mosaic
+from renditions import RenditionCache
+from recorder import Recordings
+from ws_video import VideoSocket
+from presence import sse_events
+from commands import CommandDispatcher
+from metrics import Viewer, CountingExecutor, counted, client_stats, render_prometheus
 
 # Первоначальная настройка
 app = FastAPI(
@@ -23,8 +36,12 @@ app = FastAPI(
 
 log = logging.getLogger('uvicorn')
 
-# Константы1
-_FRAME_DELAY = 1/FPS
+# Пул для работы с изображениями, чтобы не блокировать цикл событий
+image_executor = CountingExecutor(IMAGE_WORKERS, thread_name_prefix="image")
+renditions = RenditionCache(image_executor, RENDITION_CACHE_BYTES)
+recordings = Recordings(RECORDINGS_DIR)
+commands = CommandDispatcher(CLIENT_RECEIVE_PORT, COMMAND_TIMEOUT, COMMAND_RETRIES,
+                             COMMAND_BATCH, COMMAND_HISTORY)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -52,29 +69,68 @@ async def index(request: Request):
     server = app.state.server
     if not server:
         raise HTTPException(status_code=500, detail="Server not initialized")
-    with server.clients_lock:
-        client_list = [f"{addr[0]}:{addr[1]}" for addr in server.clients]
+    client_list = [(f"{addr[0]}:{addr[1]}", client.state) for addr, client in server.clients.items()]
     return templates.TemplateResponse("index.html", {"request": request, "clients": client_list})
 
 @app.get("/command", response_class=HTMLResponse)
 async def command_form(request: Request):
     return templates.TemplateResponse("command.html", {"request": request})
 
+# Команда клиентам с подтверждением. Кому: ip - один или несколько IP через
+# запятую, target=all - всем онлайн клиентам; state=active|idle - только
+# клиентам в этом состоянии. wait=false - не ждать подтверждений, результат
+# потом по /command/{id}. Ответ: статус (success/partial/error/pending) и
+# результат по каждому IP (ok/unknown/error/timeout, попытки, время ответа).
 @app.post("/command")
-async def send_command(ip: str = Form(), command: str = Form()):
+async def send_command(command: str = Form(), ip: Optional[str] = Form(None),
+                       target: Optional[str] = Form(None), state: Optional[str] = Form(None),
+                       wait: bool = Form(True)):
+    server = app.state.server
+    if not server:
+        return {"status": "error", "message": "Server not initialized"}
+    command = command.strip()
+    if not command or '\n' in command:
+        return {"status": "error", "message": "Empty or multi-line command"}
+
+    # Один проход по снимку клиентов, без блокировок: {ip: состояния его клиентов}
+    online = {}
+    for addr, client in server.clients.items():
+        online.setdefault(addr[0], set()).add(client.state)
+    if target == "all":
+        requested = list(online)
+    elif ip:
+        requested = list(dict.fromkeys(command_ip(part.strip()) for part in ip.split(',') if part.strip()))
+    else:
+        return {"status": "error", "message": "Specify ip or target=all"}
+    not_connected = [i for i in requested if i not in online]
+    ips = [i for i in requested if i in online and (not state or state in online[i])]
+    if not ips:
+        return {"status": "error", "message": "No matching clients online", "not_connected": not_connected}
+
+    record = await commands.submit(ips, command)
+    if wait:
+        await record.done.wait()
+    result = record.summary()
+    result["not_connected"] = not_connected
+    ok = result["counts"].get("ok", 0)
+    result["message"] = (f"Command {record.id} queued for {len(ips)} client(s)" if not wait
+                         else f"Command {record.id}: {ok}/{len(ips)} acknowledged")
+    return result
+
+# Адресат команды: "ip" или "ip:port" (порт не важен, команды идут на CLIENT_RECEIVE_PORT)
+def command_ip(part):
     try:
-        server = app.state.server
-        if not server:
-            return {"status": "error", "message": "Server not initialized"}
-            
-        success = server.send_command_to_client(ip, command)
-        
-        if success:
-            return {"status": "success", "message": "Command sent successfully"}
-        else:
-            return {"status": "error", "message": "Failed to send command"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        return parse_client_id(part)[0]
+    except ValueError:
+        return part
+
+# Результат команды по её id (json)
+@app.get("/command/{command_id}")
+async def get_command(command_id: int):
+    record = commands.get(command_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Command not found")
+    return record.summary()
 
 # Получение ip,port всех онлайн клиентов (json)
 @app.get("/clients", response_model=List[List[str]])
@@ -82,97 +138,200 @@ async def get_clients():
     server = app.state.server
     if not server:
         raise HTTPException(status_code=500)
-    with server.clients_lock:
-        client_list = [[addr[0], str(addr[1])] for addr in server.clients]
+    client_list = [[addr[0], str(addr[1])] for addr in server.clients]
     return client_list
 
+# Состояние онлайн клиентов: "active" - в кадре движение, "idle" - шлёт только пульс (json)
+@app.get("/clients/state")
+async def get_clients_state():
+    server = app.state.server
+    if not server:
+        raise HTTPException(status_code=500)
+    states = {f"{addr[0]}:{addr[1]}": client.state for addr, client in server.clients.items()}
+    return states
+
+# Показатели приёма и раздачи в формате Prometheus (text)
+@app.get("/metrics")
+async def metrics():
+    server = app.state.server
+    if not server:
+        raise HTTPException(status_code=500)
+    executors = {"image": image_executor, **getattr(app.state, "executors", {})}
+    return Response(content=render_prometheus(server, executors),
+                    media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Показатели одного клиента: пакеты, кадры, потери, время сборки, зрители (json)
+@app.get("/clients/{client_id}/stats")
+async def get_client_stats(client_id: str):
+    return client_stats(find_client(client_id))
+
 # Получение количества онлайн клиентов (json)
 @app.get("/number_clients")
 async def get_number_clients():
     server = app.state.server
     if not server:
         raise HTTPException(status_code=500)
-    with server.clients_lock:
-        count = len(server.clients)
+    count = len(server.clients)
     return count
 
-# Получение скрина в момент времени клиента (jpg)
-@app.get("/screenshot/{client_id}", response_class=Response)
-async def screenshot(client_id: str):
-    server = app.state.server
-    if not server:
-        raise HTTPException(status_code=500, detail="Server not initialized")
+# Адрес клиента из строки "ip:port" (id клиента в URL и командах)
+def parse_client_id(client_id):
+    ip, port = client_id.rsplit(':', 1)
+    return ip, int(port)
+
+# То же для URL: неправильный id - 404
+def client_addr_from_url(client_id):
     try:
-        ip, port = client_id.rsplit(':', 1)
-        client_addr = (ip, int(port))
+        return parse_client_id(client_id)
     except ValueError:
         raise HTTPException(status_code=404, detail="Invalid client ID format")
 
-    with server.clients_lock:
-        if client_addr not in server.clients:
-            raise HTTPException(status_code=404, detail="Client not found")
+# Поиск клиента по строке "ip:port" из URL
+def find_client(client_id):
+    server = app.state.server
+    if not server:
+        raise HTTPException(status_code=500, detail="Server not initialized")
+    client_addr = client_addr_from_url(client_id)
 
-        client = server.clients[client_addr]
-        frames = client.get_frames()  # Получаем кадры из метода get_frames
-        if not frames:
-            raise HTTPException(status_code=404, detail="No frames available")
+    client = server.clients.get(client_addr)
+    if client is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+    return client
 
-        jpeg_data = frames[-1]  # Берем последний доступный кадр
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
 
-    return Response(content=jpeg_data, media_type="image/jpeg")
+# Параметры копии кадра: ?w=<ширина>&q=<качество>&overlay=1 (нанести
+# подпись и время из метаданных кадра, если клиент сам их не рисует)
+def rendition_params(w: Optional[int] = Query(None, ge=16, le=4096),
+                     q: Optional[int] = Query(None, ge=10, le=95),
+                     overlay: bool = False):
+    if w is None and not overlay:
+        return None
+    return w, q or RENDITION_QUALITY, overlay
+
+# Получение скрина в момент времени клиента (jpg)
+# ?after=<id> - ждать, пока не появится кадр новее id (long-poll)
+@app.get("/screenshot/{client_id}", response_class=Response)
+async def screenshot(request: Request, client_id: str, after: Optional[int] = None,
+                     rendition=Depends(rendition_params)):
+    client = find_client(client_id)
+
+    # id из другой сессии клиента (после переподключения) не ждём и отдаём
+    # текущий кадр сразу, иначе 304 шли бы, пока номера не догонят after
+    long_poll = after is not None and after <= client.frames.last_id
+    if long_poll:
+        await client.frames.wait(after, LONG_POLL_TIMEOUT)
+
+    frame = client.frames.latest()  # Берем последний кадр, не забирая его у других
+    if frame is None:
+        raise HTTPException(status_code=404, detail="No frames available")
+
+    etag = f'"{client.session}-{frame.id}"'
+    if rendition:
+        w, q, overlay = rendition
+        etag = f'"{client.session}-{frame.id}-{w or 0}-{q}-{int(overlay and frame.meta is not None)}"'
+    headers = {"ETag": etag, "X-Frame-Id": str(frame.id), "Cache-Control": "no-cache"}
+    if frame.meta is not None:
+        headers["X-Frame-Label"] = frame.meta.label.encode('ascii', 'replace').decode()
+        headers["X-Capture-Time"] = f"{frame.meta.timestamp:.3f}"
+    not_modified = long_poll and frame.id <= after
+    if not_modified or _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    data = frame.data
+    if rendition:
+        data = await renditions.get(client, frame, *rendition)
+        if data is None:
+            raise HTTPException(status_code=500, detail="Failed to resize frame")
+    return Response(content=data, media_type="image/jpeg", headers=headers)
 
 # Потоковая передача видео для конкретного клиента (jpg's)
 @app.get("/video/{client_id}")
-async def video_feed(client_id: str):
+async def video_feed(client_id: str, rendition=Depends(rendition_params)):
+    client = find_client(client_id)
+
+    # Кадр отправляется только когда он есть, медленный зритель получает самый свежий
+    frames = latest_frames(client.frames)
+    if rendition:
+        frames = renditions.frames(client, frames, *rendition)
+    frames = counted(frames, Viewer(client_id, "mjpeg"))
+    return StreamingResponse(mjpeg_stream(frames),
+                             media_type=MJPEG_MEDIA_TYPE,
+                             headers=NO_CACHE_HEADERS)
+
+# Видео нескольких клиентов по одному WebSocket: подписка текстом (json),
+# кадры бинарными сообщениями с id клиента, id кадра и временем съёмки
+# (формат - ws_video.WS_FRAME_HEADER)
+@app.websocket("/ws/video")
+async def video_socket(websocket: WebSocket):
+    await websocket.accept()
+    await VideoSocket(websocket, find_client, renditions).run()
+
+# Записи ведутся по клиенту "ip:port". Диск читается в пуле потоков
+async def recording_source(client_id):
+    client_addr_from_url(client_id)
+    if client_id not in await run_in_threadpool(recordings.sources):
+        raise HTTPException(status_code=404, detail="No recordings for client")
+    return client_id
+
+# Клиенты "ip:port", у которых есть записи (json)
+@app.get("/recordings")
+async def get_recordings():
+    return await run_in_threadpool(recordings.sources)
+
+# Сегменты записи клиента: начало, конец (unix-время), кадры, байты (json)
+@app.get("/recordings/{client_id}")
+async def get_client_recordings(client_id: str):
+    return await run_in_threadpool(recordings.segment_info, await recording_source(client_id))
+
+# Записанный кадр на момент t (unix-время) или ближайший до него (jpg)
+@app.get("/recordings/{client_id}/snapshot", response_class=Response)
+async def recording_snapshot(client_id: str, t: float):
+    found = await run_in_threadpool(recordings.frame_at, await recording_source(client_id), t)
+    if found is None:
+        raise HTTPException(status_code=404, detail="No frames recorded")
+    timestamp, data = found
+    headers = {"X-Frame-Time": f"{timestamp:.3f}", "Cache-Control": "max-age=3600"}
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+# Воспроизведение записи с start по end (unix-время, по умолчанию - до конца),
+# speed - во сколько раз быстрее, 0 - без пауз (jpg's)
+@app.get("/recordings/{client_id}/replay")
+async def recording_replay(client_id: str, start: float, end: Optional[float] = None,
+                           speed: float = Query(1.0, ge=0, le=100)):
+    frames = recordings.frames(await recording_source(client_id), start, end if end is not None else float("inf"))
+    return StreamingResponse(mjpeg_stream(replay_frames(frames, speed)),
+                             media_type=MJPEG_MEDIA_TYPE,
+                             headers=NO_CACHE_HEADERS)
+
+# Мозаика из последних кадров всех клиентов (jpg's), одна на всех зрителей
+@app.get("/mosaic")
+async def mosaic_feed():
     server = app.state.server
     if not server:
         raise HTTPException(status_code=500)
-    try:
-        ip, port = client_id.rsplit(':', 1)
-        client_addr = (ip, int(port))
-    except ValueError:
-        raise HTTPException(status_code=404)
-
-    with server.clients_lock:
-        if client_addr not in server.clients:
-            raise HTTPException(status_code=404)
-
-    async def generate():
-        next_frame_time = time.time()
-        while client_addr in server.clients:
-            with server.clients_lock:
-                client = server.clients[client_addr]
-                frames = client.get_frames()  # Получаем кадры из метода get_frames
-                if frames:
-                    for frame in frames:
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n'
-                               + frame + b'\r\n')
-            next_frame_time += _FRAME_DELAY
-            sleep_time = next_frame_time - time.time()
-            if sleep_time > 0:
-                await asyncio.sleep(sleep_time)
-
-    return StreamingResponse(generate(),
-                             media_type="multipart/x-mixed-replace; boundary=frame",
-                             headers={"Cache-Control": "no-cache, no-store, must-revalidate"})
+    mosaic = getattr(app.state, "mosaic", None)
+    if mosaic is None:
+        mosaic = Mosaic(server, image_executor, MOSAIC_FPS,
+                        MOSAIC_TILE_WIDTH, MOSAIC_TILE_HEIGHT, MOSAIC_JPEG_QUALITY)
+        app.state.mosaic = mosaic
+
+    return StreamingResponse(mjpeg_stream(mosaic.stream()),
+                             media_type=MJPEG_MEDIA_TYPE,
+                             headers=NO_CACHE_HEADERS)
 
 # Поток событий
 @app.get("/stream")
-async def stream():
+async def stream(request: Request):
     server = app.state.server
     if not server:
         raise HTTPException(status_code=500)
 
-    async def event_stream():
-        prev_clients = set()
-        while True:
-            with server.clients_lock:
-                current_clients = set(f"{addr[0]}:{addr[1]}" for addr in server.clients)
-            if current_clients != prev_clients:
-                data = ','.join(current_clients) if current_clients else "empty"
-                yield f"data: {data}\n\n"
-                prev_clients = current_clients
-            await asyncio.sleep(0.1)
-
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
\ No newline at end of file
+    # Снимок списка, дальше только join/leave/state; с Last-Event-ID -
+    # только пропущенные события (формат - presence.sse_events)
+    events = sse_events(server.presence, request.headers.get("last-event-id"), PRESENCE_KEEPALIVE)
+    return StreamingResponse(events, media_type="text/event-stream", headers=NO_CACHE_HEADERS)
\ No newline at end of file
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import struct
+
+from starlette.websockets import WebSocketDisconnect
+
+from config import RENDITION_QUALITY, WS_MAX_SUBSCRIPTIONS
+from metrics import Viewer, counted
+from streaming import latest_frames
+
+# Бинарное сообщение /ws/video: длина id клиента, id кадра, время съёмки
+# (unix, из метаданных кадра или время приёма), затем id клиента "ip:port"
+# в utf-8 и JPEG до конца сообщения
+WS_FRAME_HEADER = struct.Struct('!BId')
+
+
+def pack_frame(client_id, frame):
+    name = client_id.encode()
+    timestamp = frame.meta.timestamp if frame.meta is not None else frame.timestamp
+    return WS_FRAME_HEADER.pack(len(name), frame.id % 2**32, timestamp) + name + frame.data
+
+
+# Параметры копии кадра из сообщения подписки: {"w": 320, "q": 70, "overlay": true}
+def _rendition(message):
+    w, q, overlay = message.get("w"), message.get("q"), bool(message.get("overlay"))
+    if w is not None and not (isinstance(w, int) and 16 <= w <= 4096):
+        raise ValueError("w must be 16..4096")
+    if q is not None and not (isinstance(q, int) and 10 <= q <= 95):
+        raise ValueError("q must be 10..95")
+    if w is None and not overlay:
+        return None
+    return w, q or RENDITION_QUALITY, overlay
+
+
+# Одно соединение /ws/video. Зритель шлёт текстом
+# {"subscribe": ["ip:port", ...], "w": ..., "q": ...} и {"unsubscribe": [...]},
+# сервер присылает кадры бинарными сообщениями и ошибки/отключения клиентов
+# текстом ({"error": ..., "id": ...}, {"closed": id}). Ошибка с "id" после
+# подписки (например, не удалось уменьшить кадр) завершает эту подписку.
+# На каждую подписку своя задача кладёт свежий кадр в _pending, отправляет
+# один цикл. Пока зритель не принял предыдущее сообщение, кадры в _pending
+# перезаписываются - медленный зритель получает только последний кадр
+# каждого клиента, очередь не растёт.
+class VideoSocket:
+    def __init__(self, websocket, find_client, renditions):
+        self.websocket = websocket
+        self.find_client = find_client  # "ip:port" -> Client или исключение
+        self.renditions = renditions
+        self._subscriptions = {}  # {id: Task}
+        self._pending = {}  # {id: (Frame, metrics.Viewer)}
+        self._notices = []
+        self._ready = asyncio.Event()
+
+    async def run(self):
+        sender = asyncio.create_task(self._send_loop())
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("text") is not None:
+                    self._handle(message["text"])
+                else:
+                    self._notify({"error": "Expected text message"})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
+            for task in self._subscriptions.values():
+                task.cancel()
+
+    def _handle(self, text):
+        try:
+            message = json.loads(text)
+            if not isinstance(message, dict):
+                raise ValueError("expected object")
+            unsubscribe = message.get("unsubscribe", [])
+            subscribe = message.get("subscribe", [])
+            if not isinstance(unsubscribe, list) or not isinstance(subscribe, list):
+                raise ValueError("subscribe/unsubscribe must be lists")
+            for client_id in unsubscribe:
+                task = self._subscriptions.pop(client_id, None)
+                if task is not None:
+                    task.cancel()
+                self._pending.pop(client_id, None)
+            rendition = _rendition(message) if subscribe else None
+        except (ValueError, TypeError) as e:
+            self._notify({"error": str(e)})
+            return
+
+        for client_id in subscribe:
+            if len(self._subscriptions) >= WS_MAX_SUBSCRIPTIONS:
+                self._notify({"error": "Too many subscriptions", "id": client_id})
+                break
+            try:
+                client = self.find_client(client_id)
+            except Exception:
+                self._notify({"error": "Client not found", "id": client_id})
+                continue
+            # Повторная подписка меняет параметры копии
+            old = self._subscriptions.pop(client_id, None)
+            if old is not None:
+                old.cancel()
+            self._subscriptions[client_id] = asyncio.create_task(self._watch(client_id, client, rendition))
+
+    async def _watch(self, client_id, client, rendition):
+        frames = latest_frames(client.frames)
+        if rendition:
+            frames = self.renditions.frames(client, frames, *rendition)
+        viewer = Viewer(client_id, "ws")
+        notice = {"closed": client_id}  # Кольцо закрыто - клиент отключился
+        try:
+            # Кадр засчитывается зрителю в _send_loop, когда действительно ушёл
+            async for frame in counted(frames, viewer, delivered=False):
+                self._pending[client_id] = (frame, viewer)
+                self._ready.set()
+        except Exception as e:
+            logging.error(f"Ошибка потока /ws/video для {client_id}: {e}")
+            notice = {"error": "Stream failed", "id": client_id}
+        if self._subscriptions.get(client_id) is asyncio.current_task():
+            del self._subscriptions[client_id]
+            self._pending.pop(client_id, None)
+            self._notify(notice)
+
+    def _notify(self, notice):
+        self._notices.append(notice)
+        self._ready.set()
+
+    async def _send_loop(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                notices, self._notices = self._notices, []
+                for notice in notices:
+                    await self.websocket.send_text(json.dumps(notice))
+                pending, self._pending = self._pending, {}
+                for client_id, (frame, viewer) in pending.items():
+                    if client_id in self._subscriptions:
+                        await self.websocket.send_bytes(pack_frame(client_id, frame))
+                        viewer.delivered(len(frame.data))
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            pass  # Зритель ушёл, run() получит отключение и всё остановит